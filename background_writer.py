@@ -0,0 +1,183 @@
+"""Background writer: crawl results go through a bounded queue to a thread that commits them in batches"""
+import queue
+import threading
+import time
+
+import crawl_store
+
+class BackgroundWriter:
+    """Sink that hands results to a writer thread, so the crawl loop never waits on the store.
+
+    Checkpoints are merged per subcategory (records by URL, the latest
+    counter and position, every completed page) and committed every
+    batch_size records or flush_interval seconds. When max_queued results
+    are waiting, the crawler blocks until the writer catches up. close()
+    commits everything still queued.
+
+    While the last commit of a subcategory failed, checkpoint() still queues
+    its results but returns False, so the crawler's BatchBuffer keeps them
+    and stops the crawl once its cap is reached. If the writer thread cannot
+    open the store or dies, the constructor, put(), sync() and close() raise
+    instead of waiting on it.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=5.0, max_queued=100):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.queued = {}  # (main_category, sub_category) -> results not yet committed
+        self.failing = set()  # (main_category, sub_category) whose last commit failed
+        self.pending = {}  # writer thread only: (main_category, sub_category) -> merged checkpoint
+        self.pending_since = None
+        self.full_waits = 0
+        self.conn = None  # the writer thread's own connection
+        self.error = None  # why the writer thread stopped, if it failed
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="background-writer", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        self.check_alive()
+
+    def check_alive(self):
+        """Raise when the writer thread is gone, so callers never wait on it forever"""
+        if not self.thread.is_alive():
+            raise RuntimeError(f"Background writer is not running: {self.error or 'closed'}")
+
+    def enqueue(self, item):
+        self.check_alive()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Back-pressure: the store is slower than the crawl
+            self.full_waits += 1
+            print(f"    Writer queue full ({self.queue.maxsize} results), waiting for the store")
+            while True:
+                try:
+                    self.queue.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    self.check_alive()
+
+    def put(self, key, item):
+        with self.lock:
+            self.queued[key] = self.queued.get(key, 0) + 1
+        self.enqueue(item)
+
+    def checkpoint(self, main_category, sub_category, companies_batch, crawled_count, position=None, completed_page=None, memberships=None):
+        # Copies: the crawler keeps appending to its lists
+        self.put((main_category, sub_category), (
+            "results", main_category, sub_category, list(companies_batch), crawled_count,
+            position, completed_page, list(memberships or [])
+        ))
+        with self.lock:
+            return (main_category, sub_category) not in self.failing
+
+    def sync(self, main_category, sub_category):
+        """Wait until everything queued for a subcategory is committed"""
+        with self.lock:
+            if not self.queued.get((main_category, sub_category)):
+                return
+        done = threading.Event()
+        self.enqueue(("sync", done))
+        while not done.wait(1):
+            self.check_alive()
+
+    def close(self):
+        """Commit everything still queued and stop the writer"""
+        if not self.thread.is_alive():
+            if self.error is not None:
+                raise RuntimeError(f"Background writer failed, queued results were not saved: {self.error}")
+            return
+        pending = self.queue.qsize()
+        if pending:
+            print(f"Writing {pending} queued results before exit...")
+        self.queue.put(("close",))
+        self.thread.join()
+        if self.full_waits:
+            print(f"Writer queue was full {self.full_waits} times; the store is the bottleneck")
+
+    def merge(self, item):
+        _, main_category, sub_category, records, crawled_count, position, completed_page, memberships = item
+        state = self.pending.setdefault((main_category, sub_category), {
+            "records": {}, "memberships": {}, "crawled_count": None, "position": None, "completed_pages": [], "results": 0,
+        })
+        for record in records:
+            state["records"][record.get("URL") or id(record)] = record
+        for membership in memberships:
+            state["memberships"][membership] = True
+        if crawled_count is not None:
+            state["crawled_count"] = crawled_count
+        if position is not None:
+            state["position"] = position
+        if completed_page is not None:
+            state["completed_pages"].append(completed_page)
+        state["results"] += 1
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+
+    def pending_records(self):
+        return sum(len(state["records"]) + len(state["memberships"]) for state in self.pending.values())
+
+    def flush(self):
+        """Commit every merged checkpoint, one transaction per subcategory; failed ones stay pending"""
+        for (main_category, sub_category), state in list(self.pending.items()):
+            records = list(state["records"].values())
+            try:
+                inserted = crawl_store.checkpoint(
+                    main_category, sub_category, records, state["crawled_count"], state["position"],
+                    memberships=list(state["memberships"]), completed_pages=state["completed_pages"], conn=self.conn
+                )
+                print(f"    Saved {inserted} new companies for {main_category} to {crawl_store.DB_PATH}")
+                print(f"  Updated progress: {main_category} - {sub_category}: {state['crawled_count']} companies")
+            except Exception as e:
+                print(f"  Error saving checkpoint: {e}")
+                with self.lock:
+                    self.failing.add((main_category, sub_category))
+                continue
+            del self.pending[(main_category, sub_category)]
+            with self.lock:
+                self.queued[(main_category, sub_category)] -= state["results"]
+                self.failing.discard((main_category, sub_category))
+        self.pending_since = time.monotonic() if self.pending else None
+
+    def run(self):
+        try:
+            self.conn = crawl_store.connect()
+        except Exception as e:
+            print(f"  Background writer could not open {crawl_store.DB_PATH}: {e}")
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        try:
+            self.write_loop()
+        except Exception as e:
+            print(f"  Background writer stopped: {e}")
+            self.error = e
+        finally:
+            self.conn.close()
+
+    def write_loop(self):
+        while True:
+            timeout = None
+            if self.pending_since is not None:
+                timeout = max(0, self.pending_since + self.flush_interval - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self.flush()
+                continue
+
+            if item[0] == "results":
+                self.merge(item)
+                if self.pending_records() >= self.batch_size:
+                    self.flush()
+            elif item[0] == "sync":
+                self.flush()
+                item[1].set()
+            elif item[0] == "close":
+                self.flush()
+                if self.pending:
+                    print(f"  Could not save results for {len(self.pending)} subcategories; they are crawled again next run")
+                return
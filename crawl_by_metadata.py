@@ -8,6 +8,14 @@ import time
 import os
 import unicodedata
 import re
+import argparse
+import json
+from collections import Counter
+
+from selenium.common.exceptions import TimeoutException
+
+import crawl_store
+from fetch_engine import BASE_URL, HttpEngine, PolitenessDelay
 
 def setup_driver():
     """Setup Chrome driver"""
@@ -21,6 +29,87 @@ def setup_driver():
     driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
     return driver
 
+# Resource types and third-party hosts the lean profile never downloads
+DEFAULT_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.css", "*.mp4", "*.webm",
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*adservice.google.*", "*facebook.net*",
+    "*facebook.com/tr*", "*connect.facebook.net*", "*youtube.com*",
+]
+
+def load_blocklist(path):
+    """Read URL patterns for Network.setBlockedURLs, one per line ('#' starts a comment)"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+def setup_lean_driver(blocked_urls=None):
+    """Setup headless Chrome that skips images, fonts, CSS and trackers"""
+    chrome_options = Options()
+    # Headless flags from old/yellowpages_full_crawler.py:setup_headless_driver
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-plugins")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    # Return from driver.get at DOMContentLoaded; open_page waits for the selectors it needs
+    chrome_options.page_load_strategy = 'eager'
+    # Performance log gives us Network.loadingFinished events for byte accounting
+    chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls if blocked_urls is not None else DEFAULT_BLOCKED_URLS})
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    driver.lean_profile = True
+    driver.bytes_total = 0
+    return driver
+
+def get_transferred_bytes(driver):
+    """Sum encoded bytes of network responses logged since the last call"""
+    transferred = 0
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        if message.get('method') == 'Network.loadingFinished':
+            transferred += message['params'].get('encodedDataLength', 0)
+    return transferred
+
+def report_page_bytes(driver, url):
+    """Print bytes transferred for the page just loaded (lean driver only)"""
+    if not getattr(driver, 'lean_profile', False):
+        return
+    try:
+        transferred = get_transferred_bytes(driver)
+        driver.bytes_total += transferred
+        print(f"    Transferred {transferred / 1024:.1f} KB for {url} (total {driver.bytes_total / 1048576:.1f} MB)")
+    except Exception as e:
+        print(f"    Error reading network log: {e}")
+
+def open_page(driver, url, selector, pacer=None, timeout=10):
+    """Navigate to url and wait until selector is present instead of sleeping a fixed time"""
+    if pacer:
+        pacer.wait()
+    start = time.monotonic()
+    driver.get(url)
+    try:
+        WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+        ready = True
+    except TimeoutException:
+        print(f"    Timed out waiting for '{selector}' on {url}")
+        ready = False
+    if pacer:
+        pacer.observe(time.monotonic() - start)
+    report_page_bytes(driver, url)
+    return ready
+
 def normalize_filename(text):
     """Convert Vietnamese text to ASCII filename"""
     # Remove accents
@@ -31,109 +120,107 @@ def normalize_filename(text):
     text = re.sub(r'[-\s]+', '_', text)
     return text.lower()
 
-def extract_company_detail(driver, company_url, category_name):
+# Collects every field of a company detail page in a single WebDriver round trip.
+# arguments[0] enables per-field timings (milliseconds) for debug mode.
+COMPANY_DETAIL_SCRIPT = """
+var debug = arguments[0];
+var timings = {};
+var started = performance.now();
+
+function text(el) {
+    return el ? (el.innerText || '').trim() : '';
+}
+
+function timed(field, read) {
+    var t = performance.now();
+    var value = '';
+    try {
+        value = read();
+    } catch (e) {
+        value = '';
+    }
+    timings[field] = performance.now() - t;
+    return value;
+}
+
+var elements = document.querySelectorAll('.m-0.pb-2');
+var phones = elements.length > 1 ? elements[1].querySelectorAll('.fw-semibold.fs18') : [];
+
+var result = {
+    name: timed('name', function () { return text(document.querySelector('.fs-3.text-capitalize')); }),
+    address: timed('address', function () { return text(elements[0]); }),
+    phone: timed('phone', function () { return text(phones[0]); }),
+    hotline: timed('hotline', function () { return text(phones[1]); }),
+    email: timed('email', function () {
+        return elements.length > 2 ? text(elements[2].querySelector('a')) : '';
+    }),
+    website: timed('website', function () { return text(document.querySelector('.m-0.fs18')); }),
+    intro: timed('intro', function () {
+        var headings = document.querySelectorAll('.yp_h2_border');
+        for (var i = 0; i < headings.length; i++) {
+            if (text(headings[i]).toLowerCase().indexOf('giới thiệu công ty') !== -1) {
+                var parts = [];
+                for (var sibling = headings[i].nextElementSibling; sibling; sibling = sibling.nextElementSibling) {
+                    var part = text(sibling);
+                    if (part) {
+                        parts.push(part);
+                    }
+                }
+                return parts.join(' ');
+            }
+        }
+        return '';
+    }),
+    business: timed('business', function () { return text(document.querySelector('.yp_div_nganh_thitruong')); }),
+    products: timed('products', function () {
+        var parts = [];
+        ['.yp_div_sanphamdichvu1', '.yp_div_sanphamdichvu2'].forEach(function (selector) {
+            var element = document.querySelector(selector);
+            if (element) {
+                parts.push(text(element));
+            }
+        });
+        return parts.join(' ');
+    })
+};
+
+if (debug) {
+    result.timings = timings;
+    result.total = performance.now() - started;
+}
+return result;
+"""
+
+def is_debug():
+    """Debug mode is enabled with --debug or CRAWLER_DEBUG=1"""
+    return os.environ.get("CRAWLER_DEBUG") == "1"
+
+def extract_company_detail(driver, company_url, category_name, pacer=None):
     """Extract detailed information from company page"""
     try:
-        driver.get(company_url)
-        time.sleep(3)
-        
-        name = ""
-        try:
-            name_element = driver.find_element(By.CSS_SELECTOR, ".fs-3.text-capitalize")
-            name = name_element.text.strip()
-        except:
-            pass
-        
-        elements = driver.find_elements(By.CSS_SELECTOR, ".m-0.pb-2")
-        
-        address = ""
-        if elements:
-            try:
-                address = elements[0].text.strip()
-            except:
-                pass
-        
-        phone = ""
-        hotline = ""
-        if len(elements) > 1:
-            try:
-                fw_elements = elements[1].find_elements(By.CSS_SELECTOR, ".fw-semibold.fs18")
-                if fw_elements:
-                    phone = fw_elements[0].text.strip()
-                if len(fw_elements) > 1:
-                    hotline = fw_elements[1].text.strip()
-            except:
-                pass
-        
-        email = ""
-        if len(elements) > 2:
-            try:
-                email_link = elements[2].find_element(By.CSS_SELECTOR, "a")
-                email = email_link.text.strip()
-            except:
-                pass
-        
-        website = ""
-        try:
-            website_element = driver.find_element(By.CSS_SELECTOR, ".m-0.fs18")
-            website = website_element.text.strip()
-        except:
-            pass
-        
-        intro = ""
-        try:
-            h2_elements = driver.find_elements(By.CSS_SELECTOR, ".yp_h2_border")
-            for h2 in h2_elements:
-                if "giới thiệu công ty" in h2.text.lower():
-                    siblings = driver.execute_script("""
-                        var siblings = [];
-                        var sibling = arguments[0].nextElementSibling;
-                        while (sibling) {
-                            siblings.push(sibling);
-                            sibling = sibling.nextElementSibling;
-                        }
-                        return siblings;
-                    """, h2)
-                    intro_parts = [elem.text.strip() for elem in siblings if elem.text.strip()]
-                    intro = " ".join(intro_parts)
-                    break
-        except:
-            pass
+        open_page(driver, company_url, ".fs-3.text-capitalize", pacer)
         
-        business = ""
-        try:
-            business_element = driver.find_element(By.CSS_SELECTOR, ".yp_div_nganh_thitruong")
-            business = business_element.text.strip()
-        except:
-            pass
+        debug = is_debug()
+        fields = driver.execute_script(COMPANY_DETAIL_SCRIPT, debug)
         
-        products = ""
-        try:
-            product_texts = []
-            for class_name in [".yp_div_sanphamdichvu1", ".yp_div_sanphamdichvu2"]:
-                try:
-                    element = driver.find_element(By.CSS_SELECTOR, class_name)
-                    product_texts.append(element.text.strip())
-                except:
-                    continue
-            products = " ".join(product_texts)
-        except:
-            pass
+        if debug:
+            timings = ", ".join(f"{field}={ms:.1f}ms" for field, ms in fields.get("timings", {}).items())
+            print(f"    Extraction timings: {timings} (total {fields.get('total', 0):.1f}ms)")
         
         category_parts = category_name.split(' - ', 1)
         main_category = category_parts[0] if len(category_parts) > 0 else ""
         sub_category = category_parts[1] if len(category_parts) > 1 else ""
         
         return {
-            "Tên công ty": name,
-            "Địa chỉ": address,
-            "Điện thoại": phone,
-            "Hotline": hotline,
-            "Email": email,
-            "Website": website,
-            "Giới thiệu": intro,
-            "Ngành nghề": business,
-            "Sản phẩm dịch vụ": products,
+            "Tên công ty": fields.get("name", ""),
+            "Địa chỉ": fields.get("address", ""),
+            "Điện thoại": fields.get("phone", ""),
+            "Hotline": fields.get("hotline", ""),
+            "Email": fields.get("email", ""),
+            "Website": fields.get("website", ""),
+            "Giới thiệu": fields.get("intro", ""),
+            "Ngành nghề": fields.get("business", ""),
+            "Sản phẩm dịch vụ": fields.get("products", ""),
             "Ngành": main_category,
             "Ngành nhỏ": sub_category
         }
@@ -143,317 +230,599 @@ def extract_company_detail(driver, company_url, category_name):
         return None
 
 def get_existing_companies(main_category):
-    """Get existing companies from file to avoid duplicates"""
-    filename = normalize_filename(main_category)
-    filepath = f'output/{filename}_company_details.xlsx'
-    
+    """Get names of companies stored without a URL (old workbooks) to avoid duplicates.
+
+    Everything crawled since is deduplicated by URL through crawl_store.get_dedup_index().
+    """
     existing_companies = set()
-    if os.path.exists(filepath):
-        try:
-            df = pd.read_excel(filepath)
-            existing_companies = set(df['Tên công ty'].tolist())
-            print(f"  Found {len(existing_companies)} existing companies in {filepath}")
-        except Exception as e:
-            print(f"  Error reading existing file: {e}")
+    try:
+        existing_companies = crawl_store.get_company_names(main_category)
+        if existing_companies:
+            print(f"  Found {len(existing_companies)} existing companies without URL for {main_category}")
+    except Exception as e:
+        print(f"  Error reading existing companies: {e}")
     
     return existing_companies
 
 def get_crawled_progress():
-    """Load crawled progress metadata"""
+    """Load crawled progress as {(main_category, sub_category): crawled count}"""
     try:
-        if os.path.exists('output/metadata_crawled.xlsx'):
-            return pd.read_excel('output/metadata_crawled.xlsx')
-        return pd.DataFrame(columns=['main_category', 'sub_category', 'number_company_crawled'])
+        return crawl_store.get_all_progress()
     except Exception as e:
         print(f"Error loading crawled progress: {e}")
-        return pd.DataFrame(columns=['main_category', 'sub_category', 'number_company_crawled'])
+        return {}
 
-def update_crawled_progress(main_category, sub_category, crawled_count):
-    """Update crawled progress metadata"""
+def save_checkpoint(main_category, sub_category, companies_batch, crawled_count, position=None, completed_page=None, memberships=None):
+    """Save companies, category memberships, the progress counter and resume position atomically; False on failure"""
     try:
-        progress_df = get_crawled_progress()
-        
-        # Update or add record
-        mask = (progress_df['main_category'] == main_category) & (progress_df['sub_category'] == sub_category)
-        if mask.any():
-            progress_df.loc[mask, 'number_company_crawled'] = crawled_count
-        else:
-            new_row = pd.DataFrame([{
-                'main_category': main_category,
-                'sub_category': sub_category, 
-                'number_company_crawled': crawled_count
-            }])
-            progress_df = pd.concat([progress_df, new_row], ignore_index=True)
-        
-        progress_df.to_excel('output/metadata_crawled.xlsx', index=False)
+        inserted = crawl_store.checkpoint(main_category, sub_category, companies_batch, crawled_count, position, completed_page, memberships)
+        print(f"    Saved {inserted} new companies for {main_category} to {crawl_store.DB_PATH}")
         print(f"  Updated progress: {main_category} - {sub_category}: {crawled_count} companies")
-        
+        return True
     except Exception as e:
-        print(f"  Error updating progress: {e}")
+        print(f"  Error saving checkpoint: {e}")
+        return False
 
-def save_companies_batch(main_category, companies_batch):
-    """Save batch of companies to file"""
-    if not companies_batch:
-        return
-        
-    try:
-        filename = normalize_filename(main_category)
-        filepath = f'output/{filename}_company_details.xlsx'
-        
-        # Load existing data if file exists
-        if os.path.exists(filepath):
-            try:
-                existing_df = pd.read_excel(filepath)
-                new_df = pd.DataFrame(companies_batch)
-                combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-                # Remove duplicates based on company name
-                combined_df = combined_df.drop_duplicates(subset=['Tên công ty'], keep='first')
-                combined_df.to_excel(filepath, index=False)
-                print(f"    Saved {len(companies_batch)} companies to {filepath} (total: {len(combined_df)})")
-            except Exception as e:
-                print(f"    Error updating existing file: {e}")
-                # Fallback: save new data only
-                companies_df = pd.DataFrame(companies_batch)
-                companies_df.to_excel(filepath, index=False)
-        else:
-            companies_df = pd.DataFrame(companies_batch)
-            companies_df.to_excel(filepath, index=False)
-            print(f"    Created {filepath} with {len(companies_batch)} companies")
-            
-    except Exception as e:
-        print(f"    Error saving companies batch: {e}")
+class LocalSink:
+    """Write crawl results straight to the local store and progress file"""
+
+    def checkpoint(self, main_category, sub_category, companies_batch, crawled_count, position=None, completed_page=None, memberships=None):
+        return save_checkpoint(main_category, sub_category, companies_batch, crawled_count, position, completed_page, memberships)
+
+    def sync(self, main_category, sub_category):
+        pass
+
+class QueueTaskSink(LocalSink):
+    """LocalSink that also saves each checkpoint's resume state on the leased queue task"""
+
+    def __init__(self, work_queue, task):
+        self.work_queue = work_queue
+        self.task = task
+
+    def checkpoint(self, main_category, sub_category, companies_batch, crawled_count, position=None, completed_page=None, memberships=None):
+        if not super().checkpoint(main_category, sub_category, companies_batch, crawled_count, position, completed_page, memberships):
+            return False
+        self.work_queue.save_progress(self.task, crawled_count, position, completed_page[0] if completed_page else None)
+        return True
+
+# Unsaved records a subcategory crawl may hold before it gives up on a failing store
+MAX_BUFFERED_RECORDS = 500
+
+class BatchBuffer:
+    """Company records and memberships of one subcategory that are not saved yet.
+
+    flush() hands exactly the buffered rows to the sink with a checkpoint and
+    clears them once the sink accepts them, so memory and save cost do not
+    grow with the subcategory. Tracks the high-water mark for stats().
+    """
+
+    def __init__(self, sink, main_category, sub_category, max_records=MAX_BUFFERED_RECORDS):
+        self.sink = sink
+        self.main_category = main_category
+        self.sub_category = sub_category
+        self.max_records = max_records
+        self.records = []
+        self.memberships = []
+        self.high_water = 0
+        self.saved = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self.records) + len(self.memberships)
+
+    def add(self, membership, record=None):
+        """Buffer a membership row, with the company record when it was fetched"""
+        if record is not None:
+            self.records.append(record)
+        self.memberships.append(membership)
+        self.high_water = max(self.high_water, len(self))
+
+    def full(self):
+        return len(self) >= self.max_records // 2
+
+    def check(self):
+        """Stop the crawl when checkpoints kept failing until the cap was reached"""
+        if len(self) >= self.max_records:
+            raise RuntimeError(f"{len(self)} unsaved rows buffered, the store keeps failing - stopping at the last checkpoint")
+
+    def flush(self, crawled_count, position=None, completed_page=None):
+        """Checkpoint the buffered rows with the progress counter; keep them if the sink fails"""
+        accepted = self.sink.checkpoint(self.main_category, self.sub_category, self.records, crawled_count,
+                                        position, completed_page, self.memberships)
+        if accepted is False:
+            return False
+        self.saved += len(self.records)
+        self.flushes += 1
+        self.records = []
+        self.memberships = []
+        return True
+
+    def stats(self):
+        return f"{self.saved} companies saved in {self.flushes} checkpoints, at most {self.high_water} rows buffered"
+
+# Reads the whole listing page in one WebDriver round trip, trying the same three
+# selector strategies as before: cards inside .div_listing, cards anywhere, bare links.
+COMPANY_LISTING_SCRIPT = """
+var containerSelector = '.rounded-4.border.bg-white.shadow-sm.mb-3.pb-4';
+var linkSelector = '.yp_noidunglistings .fs-5.pb-0.text-capitalize a';
+var orderSelector = '.yp_sothutu .yp_sothutu_txt small';
+var contentSelector = '.yp_noidunglistings';
+
+function text(el) {
+    return el ? (el.innerText || '').trim() : '';
+}
+
+function readCards(containers) {
+    var items = [];
+    for (var i = 0; i < containers.length; i++) {
+        var link = containers[i].querySelector(linkSelector);
+        var name = text(link);
+        if (!name || !link.href) {
+            continue;
+        }
+        var orderText = text(containers[i].querySelector(orderSelector));
+        var order = /^\\d+$/.test(orderText) ? parseInt(orderText, 10) : i + 1;
+        items.push([name, link.href, order, text(containers[i].querySelector(contentSelector) || containers[i])]);
+    }
+    return {containers: containers.length, items: items};
+}
+
+var listing = document.querySelector('.div_listing');
+if (listing) {
+    var cards = readCards(listing.querySelectorAll(containerSelector));
+    if (cards.items.length) {
+        return {strategy: 'div_listing', containers: cards.containers, items: cards.items};
+    }
+}
+
+var bareCards = readCards(document.querySelectorAll(containerSelector));
+if (bareCards.items.length) {
+    return {strategy: 'containers', containers: bareCards.containers, items: bareCards.items};
+}
+
+var links = document.querySelectorAll(linkSelector);
+var items = [];
+for (var j = 0; j < links.length; j++) {
+    var name = text(links[j]);
+    if (name && links[j].href) {
+        items.push([name, links[j].href, j + 1, name]);
+    }
+}
+return {strategy: items.length ? 'links' : 'none', containers: links.length, items: items};
+"""
 
-def get_company_data_with_order(driver):
+# How often each listing strategy matched during this run
+LISTING_STRATEGY_COUNTS = Counter()
+
+def get_company_data_with_order(driver, card_texts=None):
     """Get company data with correct order numbers by finding parent containers"""
     company_data = []
     try:
-        # Find div_listing parent container first
-        div_listing = driver.find_element(By.CSS_SELECTOR, ".div_listing")
-        
-        # Find all child divs with class "rounded-4 border bg-white shadow-sm mb-3 pb-4" inside div_listing
-        listing_divs = div_listing.find_elements(By.CSS_SELECTOR, ".rounded-4.border.bg-white.shadow-sm.mb-3.pb-4")
-        print(f"    Found {len(listing_divs)} listing containers in div_listing")
+        listing = driver.execute_script(COMPANY_LISTING_SCRIPT)
+        strategy = listing.get("strategy", "none")
+        LISTING_STRATEGY_COUNTS[strategy] += 1
+        print(f"    Found {listing.get('containers', 0)} listing containers (strategy: {strategy})")
         
-        for i, listing_div in enumerate(listing_divs):
-            try:
-                # Find yp_noidunglistings div for company link
-                company_link = listing_div.find_element(By.CSS_SELECTOR, ".yp_noidunglistings .fs-5.pb-0.text-capitalize a")
-                name = company_link.text.strip()
-                href = company_link.get_attribute('href')
-                
-                if name and href:
-                    # Try to get order number, use index as fallback
-                    try:
-                        order_elem = listing_div.find_element(By.CSS_SELECTOR, ".yp_sothutu .yp_sothutu_txt small")
-                        order_num = int(order_elem.text.strip())
-                    except:
-                        order_num = i + 1  # Use index as fallback
-                    
-                    company_data.append((name, href, order_num))
-                    print(f"      Found #{order_num}: {name}")
-                    
-            except Exception as e:
-                print(f"      Error processing listing {i+1}: {e}")
-                continue
-                    
+        for name, href, order_num, card_text in listing.get("items", []):
+            company_data.append((name, href, int(order_num)))
+            if card_texts is not None:
+                card_texts[href] = card_text
+            print(f"      Found #{order_num}: {name}")
     except Exception as e:
-        print(f"    Error getting company data from div_listing: {e}")
-        # Fallback: try without div_listing parent
-        try:
-            listing_divs = driver.find_elements(By.CSS_SELECTOR, ".rounded-4.border.bg-white.shadow-sm.mb-3.pb-4")
-            print(f"    Fallback: Found {len(listing_divs)} listing containers")
-            
-            for i, listing_div in enumerate(listing_divs):
-                try:
-                    # Find yp_noidunglistings div for company link
-                    company_link = listing_div.find_element(By.CSS_SELECTOR, ".yp_noidunglistings .fs-5.pb-0.text-capitalize a")
-                    name = company_link.text.strip()
-                    href = company_link.get_attribute('href')
-                    
-                    if name and href:
-                        # Try to get order number, use index as fallback
-                        try:
-                            order_elem = listing_div.find_element(By.CSS_SELECTOR, ".yp_sothutu .yp_sothutu_txt small")
-                            order_num = int(order_elem.text.strip())
-                        except:
-                            order_num = i + 1  # Use index as fallback
-                        
-                        company_data.append((name, href, order_num))
-                        
-                except Exception as e2:
-                    continue
-        except Exception as e2:
-            print(f"    Ultimate fallback error: {e2}")
-            # Last resort: old method
-            try:
-                company_divs = driver.find_elements(By.CSS_SELECTOR, ".yp_noidunglistings .fs-5.pb-0.text-capitalize a")
-                print(f"    Last resort: Found {len(company_divs)} company links")
-                for i, div in enumerate(company_divs):
-                    try:
-                        name = div.text.strip()
-                        href = div.get_attribute('href')
-                        if name and href:
-                            company_data.append((name, href, i + 1))
-                    except:
-                        continue
-            except:
-                pass
+        print(f"    Error getting company data: {e}")
     
-    print(f"    Total company data extracted: {len(company_data)}")
+    strategy_counts = ", ".join(f"{strategy}={count}" for strategy, count in LISTING_STRATEGY_COUNTS.items())
+    print(f"    Total company data extracted: {len(company_data)} (strategies so far: {strategy_counts})")
     return company_data
 
-def crawl_companies_from_subcategory(driver, main_category, sub_category, max_companies, existing_companies=None, start_from=0):
-    """Crawl companies from a specific subcategory with resume capability"""
+def find_next_page_link(driver):
+    """Return the 'Tiếp' link from #paging on the current page, or None"""
+    paging_links = driver.find_elements(By.CSS_SELECTOR, "#paging a")
+    for link in paging_links:
+        if link.text.strip() == "Tiếp":
+            href = link.get_attribute('href')
+            if href and href != "#":
+                return href
+    return None
+
+class SeleniumEngine:
+    """Fetch engine driving a real Chrome through Selenium"""
+
+    name = "selenium"
+
+    def __init__(self, driver=None, pacer=None):
+        self.driver = driver or setup_driver()
+        self.pacer = pacer or PolitenessDelay()
+        # Next-page link harvested from the last listing page, read before leaving it
+        self.listing_next = (None, None)
+        self.card_texts = {}  # href -> card text of the last listing page(s)
+
+    def find_links(self, url, selector):
+        """Return (text, href) for links matching selector on url"""
+        open_page(self.driver, url, selector, self.pacer)
+        elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
+        return [(elem.text.strip(), elem.get_attribute('href')) for elem in elements]
+
+    def find_links_many(self, urls, selector):
+        """find_links for several pages, one at a time"""
+        return [self.find_links(url, selector) for url in urls]
+
+    def load_listing(self, url):
+        """Navigate to a listing page and harvest its companies and next-page link"""
+        open_page(self.driver, url, ".div_listing", self.pacer)
+        self.card_texts = {}
+        company_data = get_company_data_with_order(self.driver, self.card_texts)
+        # Read pagination now so we never have to come back to this page
+        try:
+            self.listing_next = (url, find_next_page_link(self.driver))
+        except Exception as e:
+            print(f"    Error reading pagination: {e}")
+            self.listing_next = (None, None)
+        return company_data
+
+    def load_listings(self, urls):
+        """Load listing pages one at a time, returning their company lists in urls order"""
+        listings = []
+        card_texts = {}
+        for url in urls:
+            listings.append(self.load_listing(url))
+            card_texts.update(self.card_texts)
+        self.card_texts = card_texts
+        return listings
+
+    def next_page_link(self, page_url):
+        """Return the next listing page URL for page_url, or None"""
+        harvested_url, next_link = self.listing_next
+        if harvested_url == page_url:
+            return next_link
+        open_page(self.driver, page_url, ".div_listing", self.pacer)
+        return find_next_page_link(self.driver)
+
+    def load_detail(self, url, category_name):
+        """Extract a company detail page"""
+        return extract_company_detail(self.driver, url, category_name, self.pacer)
+
+    def load_details(self, company_data, category_name):
+        """Extract detail pages one at a time, ordered by order"""
+        results = []
+        for name, href, order in sorted(company_data, key=lambda item: item[2]):
+            print(f"      Crawling #{order}: {name}")
+            results.append((name, href, order, self.load_detail(href, category_name)))
+        return results
+
+    def close(self):
+        self.driver.quit()
+
+class FallbackEngine:
+    """HTTP engine that falls back to Selenium per page when parsing comes back empty"""
+
+    name = "auto"
+
+    def __init__(self, max_per_host=8, pacer=None, driver_factory=setup_driver):
+        self.pacer = pacer or PolitenessDelay()
+        self.http = HttpEngine(max_per_host=max_per_host, pacer=self.pacer)
+        self.driver_factory = driver_factory
+        self.selenium = None
+        self.listing_from_selenium = False
+        self.card_texts = {}
+
+    def get_selenium(self):
+        """Start the fallback browser on first use"""
+        if self.selenium is None:
+            print("    Starting Selenium fallback engine")
+            self.selenium = SeleniumEngine(self.driver_factory(), pacer=self.pacer)
+        return self.selenium
+
+    def find_links(self, url, selector):
+        links = self.http.find_links(url, selector)
+        if not links:
+            print(f"    HTTP parse empty for {url}, falling back to Selenium")
+            links = self.get_selenium().find_links(url, selector)
+        return links
+
+    def find_links_many(self, urls, selector):
+        results = self.http.find_links_many(urls, selector)
+        for i, url in enumerate(urls):
+            if not results[i]:
+                print(f"    HTTP parse empty for {url}, falling back to Selenium")
+                results[i] = self.get_selenium().find_links(url, selector)
+        return results
+
+    def load_listing(self, url):
+        self.listing_from_selenium = False
+        company_data = self.http.load_listing(url)
+        self.card_texts = self.http.card_texts
+        if not company_data:
+            print(f"    HTTP parse empty for {url}, falling back to Selenium")
+            self.listing_from_selenium = True
+            company_data = self.get_selenium().load_listing(url)
+            self.card_texts = self.selenium.card_texts
+        return company_data
+
+    def load_listings(self, urls):
+        listings = self.http.load_listings(urls)
+        self.card_texts = dict(self.http.card_texts)
+        for i, url in enumerate(urls):
+            if not listings[i]:
+                print(f"    HTTP parse empty for {url}, falling back to Selenium")
+                listings[i] = self.get_selenium().load_listing(url)
+                self.card_texts.update(self.selenium.card_texts)
+                if not listings[i]:
+                    # Really empty - later pages are past the end of the listing
+                    break
+        return listings
+
+    def next_page_link(self, page_url):
+        if self.listing_from_selenium:
+            return self.get_selenium().next_page_link(page_url)
+        return self.http.next_page_link(page_url)
+
+    def load_detail(self, url, category_name):
+        company_info = self.http.load_detail(url, category_name)
+        if company_info is None:
+            print(f"    HTTP parse empty for {url}, falling back to Selenium")
+            company_info = self.get_selenium().load_detail(url, category_name)
+        return company_info
+
+    def load_details(self, company_data, category_name):
+        results = self.http.load_details(company_data, category_name)
+        failed = [(name, href, order) for name, href, order, company_info in results if company_info is None]
+        if not failed:
+            return results
+        print(f"    HTTP parse empty for {len(failed)} detail pages, falling back to Selenium")
+        retried = {href: company_info for _, href, _, company_info in self.get_selenium().load_details(failed, category_name)}
+        return [(name, href, order, company_info if company_info is not None else retried.get(href))
+                for name, href, order, company_info in results]
+
+    def close(self):
+        self.http.close()
+        if self.selenium is not None:
+            self.selenium.close()
+
+ENGINE_NAMES = ["auto", "http", "selenium"]
+
+def create_engine(name, max_per_host=8, delay=0.5, max_delay=10.0, lean=False, blocked_urls=None):
+    """Create a fetch engine by name: selenium, http or auto"""
+    pacer = PolitenessDelay(base_delay=delay, max_delay=max_delay)
+    if lean:
+        driver_factory = lambda: setup_lean_driver(blocked_urls)
+    else:
+        driver_factory = setup_driver
+    if name == "selenium":
+        return SeleniumEngine(driver_factory(), pacer=pacer)
+    if name == "http":
+        return HttpEngine(max_per_host=max_per_host, pacer=pacer)
+    return FallbackEngine(max_per_host=max_per_host, pacer=pacer, driver_factory=driver_factory)
+
+def find_main_category_url(engine, main_category):
+    """Find the main category URL from the homepage"""
+    main_links = engine.find_links(BASE_URL, ".p-2.ps-1 a.text-dark")
+    for text, href in main_links:
+        if text == main_category:
+            return href
+    return None
+
+def find_subcategory_url(engine, main_href, sub_category):
+    """Find the subcategory URL on a main category page"""
+    sub_links = engine.find_links(main_href, ".col-sm-6.p-4.pe-3.pt-0.pb-2 a")
+    for text, href in sub_links:
+        # Remove (number) from text for comparison
+        clean_text = re.sub(r'\s*\(\d+\)$', '', text)
+        if clean_text == sub_category:
+            return href
+    return None
+
+def resolve_subcategory_url(engine, main_category, sub_category, main_href=None):
+    """Resolve the subcategory listing URL by navigating the category pages"""
+    sub_href = None
+    if main_href:
+        sub_href = find_subcategory_url(engine, main_href, sub_category)
+    
+    if not sub_href:
+        # Stored main category URL missing or stale - start from the homepage
+        main_href = find_main_category_url(engine, main_category)
+        if not main_href:
+            print(f"  Main category '{main_category}' not found")
+            return None
+        sub_href = find_subcategory_url(engine, main_href, sub_category)
+    
+    if not sub_href:
+        print(f"  Subcategory '{sub_category}' not found")
+    return sub_href
+
+def get_stored_url(row, column):
+    """Read a URL column from a metadata row, None when missing or empty"""
+    value = row.get(column)
+    return value if isinstance(value, str) and value else None
+
+def crawl_companies_from_subcategory(engine, main_category, sub_category, max_companies, existing_companies=None, start_from=0, sink=None, main_href=None, sub_href=None, max_pages=None,
+                                     max_buffered=MAX_BUFFERED_RECORDS, raise_errors=False, resume=None):
+    """Crawl companies from a specific subcategory with resume capability.
+
+    With max_pages, stop after that many listing pages (a scheduler time
+    slice); the checkpointed position lets the next slice continue. Returns
+    the number of companies fetched. Errors are printed and the crawl stops
+    early; with raise_errors, a crawl cut short by errors (or with companies
+    that failed to load or save) then raises RuntimeError. resume is a
+    ((page_url, page, order) or None, completed pages) pair to continue from
+    instead of the local store's, e.g. the state saved on a queue task.
+    """
     if existing_companies is None:
         existing_companies = set()
-        
-    companies = []
+    if sink is None:
+        sink = LocalSink()
+    # A previous slice of this subcategory may still be in the writer queue
+    sink.sync(main_category, sub_category)
+    
+    # Detail URLs already fetched anywhere in the catalogue, by any run or worker
+    seen_urls = crawl_store.get_dedup_index()
+    seen_urls.refresh()
+    
+    def is_known(name, href):
+        return href in seen_urls or name in existing_companies
+    
+    # Companies already counted for this subcategory, and the records and (url, main, sub, order) rows not saved yet
+    member_urls = crawl_store.get_membership_urls(main_category, sub_category)
+    buffer = BatchBuffer(sink, main_category, sub_category, max_buffered)
+    last_checkpoint_count = start_from
+    fetched = 0
+    errors = []
     
     try:
-        # Navigate to yellowpages and find the category
-        driver.get("https://www.yellowpages.vn/")
-        time.sleep(3)
-        
-        # Find main category link
-        main_elements = driver.find_elements(By.CSS_SELECTOR, ".p-2.ps-1 a.text-dark")
-        main_href = None
-        
-        for elem in main_elements:
-            if elem.text.strip() == main_category:
-                main_href = elem.get_attribute('href')
-                break
-        
-        if not main_href:
-            print(f"  Main category '{main_category}' not found")
-            return companies
-        
-        # Navigate to main category
-        driver.get(main_href)
-        time.sleep(3)
-        
-        # Find subcategory link
-        sub_elements = driver.find_elements(By.CSS_SELECTOR, ".col-sm-6.p-4.pe-3.pt-0.pb-2 a")
-        sub_href = None
-        
-        for elem in sub_elements:
-            elem_text = elem.text.strip()
-            # Remove (number) from text for comparison
-            clean_text = re.sub(r'\s*\(\d+\)$', '', elem_text)
-            if clean_text == sub_category:
-                sub_href = elem.get_attribute('href')
-                break
-        
+        # Go straight to the URL stored in categories_metadata.xlsx when we have one
+        resolved = not sub_href
         if not sub_href:
-            print(f"  Subcategory '{sub_category}' not found")
-            return companies
+            sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+            if not sub_href:
+                if raise_errors:
+                    raise RuntimeError(f"No listing URL found for {main_category} - {sub_category}")
+                return fetched
         
         # Store base subcategory URL for pagination
         base_subcategory_url = sub_href
         
-        # Calculate starting page based on crawled count (assuming ~45 companies per page)
-        start_page = max(1, (start_from // 45) + 1) if start_from > 0 else 1
+        # Resume at the exact page and card recorded in the last checkpoint
+        if resume is not None:
+            resume_point, completed_pages = resume
+        else:
+            resume_point = crawl_store.get_resume_point(main_category, sub_category) if start_from > 0 else None
+            completed_pages = crawl_store.get_completed_pages(main_category, sub_category) if start_from > 0 else set()
+        resume_after_order = 0
         
-        # Navigate to appropriate starting page
-        if start_page > 1:
-            start_url = f"{base_subcategory_url}?page={start_page}"
-            print(f"    Resuming from page {start_page}: {start_url}")
-            driver.get(start_url)
+        if resume_point:
+            page_url, start_page, resume_after_order = resume_point
+            print(f"    Resuming at page {start_page} after #{resume_after_order}: {page_url}")
         else:
-            driver.get(base_subcategory_url)
-        time.sleep(3)
+            # No recorded position (older checkpoint) - estimate the page (assuming ~45 companies per page)
+            start_page = max(1, (start_from // 45) + 1) if start_from > 0 else 1
+            if start_page > 1:
+                page_url = f"{base_subcategory_url}?page={start_page}"
+                print(f"    Resuming from page {start_page}: {page_url}")
+            else:
+                page_url = base_subcategory_url
         
         # Crawl companies from all pages
         page = start_page
         crawled_count = start_from
+        empty_pages_count = 0
+        pages_crawled = 0
         
         while crawled_count < max_companies:
+            if page in completed_pages:
+                # Never re-parse a page a previous run finished
+                print(f"    Page {page} already completed, skipping")
+                page += 1
+                page_url = f"{base_subcategory_url}?page={page}"
+                resume_after_order = 0
+                continue
+            
+            buffer.check()
             print(f"    Page {page}... ({crawled_count}/{max_companies})")
             
             # Get companies with their correct order numbers
-            company_data = get_company_data_with_order(driver)
+            company_data = engine.load_listing(page_url)
+            
+            if not company_data and not resolved:
+                # Stored URL returned no listings - re-resolve through the category pages once
+                print(f"    No listings at stored URL {base_subcategory_url}, re-resolving")
+                sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+                if sub_href and sub_href != base_subcategory_url:
+                    base_subcategory_url = sub_href
+                    page_url = f"{base_subcategory_url}?page={page}" if page > 1 else base_subcategory_url
+                    company_data = engine.load_listing(page_url)
+            resolved = True
             
             if not company_data:
                 print(f"    No companies found on page {page}")
                 break
             
-            # Count new companies on this page
+            if resume_after_order:
+                # Cards up to the checkpointed order were processed before the restart
+                company_data = [item for item in company_data if item[2] > resume_after_order]
+                resume_after_order = 0
+            
+            # Count companies on this page not yet counted for this subcategory
             new_companies_on_page = 0
             for name, href, order in company_data:
-                if name not in existing_companies:
+                if crawl_store.canonical_url(href) not in member_urls:
                     new_companies_on_page += 1
             
             print(f"    Found {new_companies_on_page} new companies on page {page} (total progress: {crawled_count}/{max_companies})")
             
             # If no new companies for several pages, consider stopping
             if new_companies_on_page == 0:
-                if not hasattr(crawl_companies_from_subcategory, 'empty_pages_count'):
-                    crawl_companies_from_subcategory.empty_pages_count = 0
-                crawl_companies_from_subcategory.empty_pages_count += 1
+                empty_pages_count += 1
                 
-                if crawl_companies_from_subcategory.empty_pages_count >= 5:
+                if empty_pages_count >= 5:
                     print(f"    No new companies found in 5 consecutive pages - likely reached end of unique data")
                     print(f"    Current progress: {crawled_count}/{max_companies} companies")
                     break
             else:
-                crawl_companies_from_subcategory.empty_pages_count = 0
-            
-            # Store current page URL before crawling companies
-            current_page_url = driver.current_url
+                empty_pages_count = 0
             
-            # Crawl each company
+            # Pick the companies still needed from this page
+            pending = []
+            pending_urls = set()
             for name, href, order in company_data:
-                if crawled_count >= max_companies:
+                if crawled_count + len(pending) >= max_companies:
                     break
                 
-                # Skip if already exists
-                if name in existing_companies:
+                # Skip if already counted for this subcategory
+                url_key = crawl_store.canonical_url(href)
+                if url_key in member_urls or url_key in pending_urls:
                     print(f"      Skipping existing: {name}")
                     continue
-                    
+                
+                # Fetched under another category - attach the membership without a page load
+                if is_known(name, href):
+                    buffer.add((url_key, main_category, sub_category, order))
+                    member_urls.add(url_key)
+                    crawled_count += 1
+                    print(f"      + #{order} {name} already crawled, added to {sub_category} ({crawled_count}/{max_companies})")
+                    continue
+                
+                pending.append((name, href, order))
+                pending_urls.add(url_key)
+            
+            # Fetch detail pages (concurrently for the HTTP engine), results ordered by order
+            try:
+                results = engine.load_details(pending, f"{main_category} - {sub_category}")
+            except Exception as e:
+                print(f"      ✗ Error crawling page {page}: {e}")
+                errors.append(f"page {page}: {e}")
+                results = []
+            
+            # Crawl each company
+            for name, href, order, company_info in results:
                 try:
-                    print(f"      Crawling #{order}: {name}")
-                    company_info = extract_company_detail(driver, href, f"{main_category} - {sub_category}")
                     if company_info:
-                        companies.append(company_info)
+                        url_key = crawl_store.canonical_url(href)
+                        company_info["URL"] = url_key
+                        buffer.add((url_key, main_category, sub_category, order), company_info)
+                        member_urls.add(url_key)
                         crawled_count += 1
-                        existing_companies.add(name)
-                        print(f"      ✓ {name} ({crawled_count}/{max_companies})")
+                        fetched += 1
+                        seen_urls.add(href)
+                        print(f"      ✓ #{order} {name} ({crawled_count}/{max_companies})")
                         
                         # Update progress and save data every 10 companies
-                        if crawled_count % 10 == 0:
-                            update_crawled_progress(main_category, sub_category, crawled_count)
-                            # Save current batch of companies
-                            current_batch = [comp for comp in companies if comp['Ngành'] == main_category and comp['Ngành nhỏ'] == sub_category]
-                            if current_batch:
-                                save_companies_batch(main_category, current_batch)
-                    
-                    # Return to subcategory page after crawling each company
-                    driver.get(current_page_url)
-                    time.sleep(2)
+                        if crawled_count - last_checkpoint_count >= 10 or buffer.full():
+                            # Save the unsaved companies together with the progress counter and position
+                            buffer.flush(crawled_count, (page_url, page, order))
+                            last_checkpoint_count = crawled_count
+                    else:
+                        errors.append(f"no details for {href}")
                             
                 except Exception as e:
                     print(f"      ✗ Error crawling {name}: {e}")
-                    # Still return to subcategory page even if error
-                    try:
-                        driver.get(current_page_url)
-                        time.sleep(2)
-                    except:
-                        pass
+                    errors.append(f"{href}: {e}")
                     continue
             
             # Try to go to next page if we haven't reached target and there are still new companies
             if crawled_count < max_companies:
                 try:
                     # Find next page link in pagination
-                    next_link = None
-                    paging_links = driver.find_elements(By.CSS_SELECTOR, "#paging a")
-                    
-                    for link in paging_links:
-                        if link.text.strip() == "Tiếp":
-                            href = link.get_attribute('href')
-                            if href and href != "#":
-                                next_link = href
-                                break
+                    next_link = engine.next_page_link(page_url)
                     
                     if next_link:
                         if next_link.startswith('?'):
@@ -462,9 +831,16 @@ def crawl_companies_from_subcategory(driver, main_category, sub_category, max_co
                             next_page_url = next_link
                         
                         print(f"    Going to next page: {next_page_url}")
-                        driver.get(next_page_url)
-                        time.sleep(3)
+                        # Page fully processed - resume from the start of the next one
+                        buffer.flush(crawled_count, (next_page_url, page + 1, 0), (page, page_url))
+                        last_checkpoint_count = crawled_count
+                        page_url = next_page_url
                         page += 1
+                        
+                        pages_crawled += 1
+                        if max_pages and pages_crawled >= max_pages:
+                            print(f"    Time slice of {max_pages} pages used, yielding to other subcategories")
+                            break
                     else:
                         # No more pages - check if we should continue or stop
                         if new_companies_on_page == 0:
@@ -478,16 +854,17 @@ def crawl_companies_from_subcategory(driver, main_category, sub_category, max_co
                             for attempt_page in range(page + 1, page + max_empty_pages + 1):
                                 next_page_url = f"{base_subcategory_url}?page={attempt_page}"
                                 print(f"    Trying page {attempt_page}: {next_page_url}")
-                                driver.get(next_page_url)
-                                time.sleep(3)
                                 
-                                test_companies = get_company_data_with_order(driver)
+                                test_companies = engine.load_listing(next_page_url)
                                 if test_companies:
                                     # Count new companies on this test page
-                                    test_new_count = sum(1 for name, _, _ in test_companies if name not in existing_companies)
+                                    test_new_count = sum(1 for _, href, _ in test_companies if crawl_store.canonical_url(href) not in member_urls)
                                     if test_new_count > 0:
                                         print(f"    Found {test_new_count} new companies on page {attempt_page} - continuing")
+                                        buffer.flush(crawled_count, (next_page_url, attempt_page, 0), (page, page_url))
+                                        last_checkpoint_count = crawled_count
                                         page = attempt_page
+                                        page_url = next_page_url
                                         break
                                     else:
                                         pages_without_new += 1
@@ -502,49 +879,172 @@ def crawl_companies_from_subcategory(driver, main_category, sub_category, max_co
                         
                 except Exception as e:
                     print(f"    Error navigating to next page: {e}")
+                    errors.append(f"next page after {page}: {e}")
                     break
             else:
                 print(f"    Reached target {max_companies} companies")
                 break
         
         # Final progress update and save remaining companies
-        update_crawled_progress(main_category, sub_category, crawled_count)
-        if companies:
-            save_companies_batch(main_category, companies)
+        if buffer.flush(crawled_count) is False:
+            errors.append("could not save the last checkpoint")
         
     except Exception as e:
         print(f"  Error crawling subcategory: {e}")
+        errors.append(str(e))
     
-    return companies
+    print(f"    Buffer: {buffer.stats()}")
+    if raise_errors and errors:
+        raise RuntimeError(f"{main_category} - {sub_category} did not finish ({len(errors)} errors, first: {errors[0]})")
+    return fetched
 
-def find_resume_position(metadata_df, progress_df):
+def find_resume_position(metadata_df):
     """Find the last incomplete subcategory to resume from"""
-    if progress_df.empty:
+    last_progress = crawl_store.get_last_progress()
+    if last_progress is None:
         return 0  # Start from beginning
     
-    # Get last progress entry
-    last_progress = progress_df.iloc[-1]
-    last_main = last_progress['main_category']
-    last_sub = last_progress['sub_category']
-    last_count = last_progress['number_company_crawled']
-    
+    last_main, last_sub, last_count = last_progress
     print(f"Last progress: {last_main} - {last_sub}: {last_count} companies")
     
     # Find position in metadata
-    for idx, row in metadata_df.iterrows():
-        if row['main_category'] == last_main and row['sub_category'] == last_sub:
-            # Check if this subcategory is completed
-            if last_count >= row['number_website']:
-                print(f"  Last subcategory completed, starting from next one")
-                return idx + 1  # Start from next subcategory
-            else:
-                print(f"  Resuming incomplete subcategory at position {idx}")
-                return idx  # Resume this subcategory
+    matches = metadata_df.index[(metadata_df['main_category'] == last_main) & (metadata_df['sub_category'] == last_sub)]
+    if len(matches) == 0:
+        return 0  # Fallback to beginning
+    
+    idx = metadata_df.index.get_loc(matches[0])
+    # Check if this subcategory is completed
+    if last_count >= metadata_df.iloc[idx]['number_website']:
+        print(f"  Last subcategory completed, starting from next one")
+        return idx + 1  # Start from next subcategory
+    print(f"  Resuming incomplete subcategory at position {idx}")
+    return idx  # Resume this subcategory
+
+def get_subcategory_start(progress, main_category, sub_category, max_companies):
+    """Return how many companies are already crawled, or None if the subcategory is complete"""
+    crawled_count = progress.get((main_category, sub_category))
+    
+    if crawled_count is not None:
+        if crawled_count >= max_companies:
+            print(f"  Skipping - already completed ({crawled_count}/{max_companies})")
+            return None
+        print(f"  Resuming from {crawled_count} to {max_companies}")
+        return crawled_count
+    
+    print(f"  Starting fresh ({max_companies} companies)")
+    return 0
+
+PHASES = ["interleaved", "harvest", "fetch", "recrawl"]
+
+def crawl_scheduled(engine, metadata_df, policies, slice_pages=None, sink=None):
+    """Crawl subcategories in priority order, slice_pages listing pages at a time"""
+    from scheduler import Scheduler, build_work_items
+    scheduler = Scheduler(build_work_items(metadata_df), policies)
+    print(f"Scheduling {len(scheduler.items)} incomplete subcategories by {', '.join(policies)}"
+          + (f", {slice_pages} pages per slice" if slice_pages else ""))
+    
+    while True:
+        item = scheduler.next()
+        if item is None:
+            break
+        main_category = item['main_category']
+        sub_category = item['sub_category']
+        print(f"\n[{item['idx']+1}/{len(metadata_df)}] Processing: {main_category} - {sub_category} "
+              f"({item['crawled']}/{item['max_companies']}, {len(scheduler.items)} others waiting)")
+        
+        fetched = crawl_companies_from_subcategory(
+            engine, main_category, sub_category, item['max_companies'], get_existing_companies(main_category), item['crawled'],
+            sink=sink, main_href=item['main_href'], sub_href=item['sub_href'], max_pages=slice_pages
+        )
+        print(f"  Crawled {fetched} new companies from {sub_category}")
+        if sink is not None:
+            sink.sync(main_category, sub_category)
+        scheduler.report(item, crawl_store.get_progress(main_category, sub_category) or 0)
+    
+    backing_off = len(scheduler.items)
+    if backing_off:
+        print(f"\n{backing_off} subcategories are backing off after failures, left for a later run")
+
+def run_queue_task(engine, task, work_queue=None):
+    """Run one leased work queue task: a whole subcategory or a single listing page.
+
+    With the work queue, the resume state saved on the task (by whichever
+    host ran it before) takes precedence over the local store's.
+    """
+    from work_queue import resume_state
+    main_category = task['main_category']
+    sub_category = task['sub_category']
+    max_companies = task['number_website']
+    if task['page']:
+        from frontier import crawl_listing_page
+        return crawl_listing_page(engine, main_category, sub_category, task['page'], max_companies,
+                                  task['main_href'], task['sub_href'], work_queue, task)
+    
+    state = resume_state(task) if work_queue else None
+    resume = None
+    if state is not None:
+        crawled_count, position, completed_pages = state
+        crawled_count = get_subcategory_start({(main_category, sub_category): crawled_count}, main_category, sub_category, max_companies)
+        resume = (position, completed_pages)
+    else:
+        crawled_count = get_subcategory_start(get_crawled_progress(), main_category, sub_category, max_companies)
+    if crawled_count is not None:
+        fetched = crawl_companies_from_subcategory(
+            engine, main_category, sub_category, max_companies, get_existing_companies(main_category), crawled_count,
+            sink=QueueTaskSink(work_queue, task) if work_queue else None,
+            main_href=task['main_href'], sub_href=task['sub_href'], raise_errors=True, resume=resume
+        )
+        print(f"  Crawled {fetched} new companies from {sub_category}")
+    return None
+
+def queue_worker(queue_spec, engine_name="auto", engine_options=None):
+    """Claim and crawl tasks from the work queue until none are left"""
+    from work_queue import open_queue, run_worker
+    work_queue = open_queue(queue_spec)
+    engine = create_engine(engine_name, **(engine_options or {}))
+    print(f"Using {engine.name} fetch engine")
+    try:
+        run_worker(work_queue, lambda task: run_queue_task(engine, task, work_queue))
+    finally:
+        engine.close()
+        crawl_store.close_output_sink()
+
+def crawl_from_queue(metadata_df, queue_spec, unit="subcategory", engine_name="auto", workers=1, engine_options=None):
+    """Enqueue the metadata's tasks (existing ones are kept) and run workers on this host"""
+    from work_queue import build_tasks, open_queue
+    work_queue = open_queue(queue_spec)
+    added = work_queue.enqueue(build_tasks(metadata_df, unit))
+    print(f"Queued {added} new {unit} tasks in the {work_queue.name} queue: {work_queue.counts()}")
+    if workers <= 1:
+        queue_worker(queue_spec, engine_name, engine_options)
+        return
     
-    return 0  # Fallback to beginning
+    import multiprocessing as mp
+    processes = [mp.Process(target=queue_worker, args=(queue_spec, engine_name, engine_options)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
 
-def crawl_by_metadata():
+def filter_grown_subcategories(metadata_df):
+    """Keep only subcategories added or grown in the last scan_metadata.py --diff"""
+    grown = crawl_store.get_grown_subcategories()
+    if grown is None:
+        print("No metadata diff recorded yet (run scan_metadata.py --diff), crawling every subcategory")
+        return metadata_df
+    mask = [(main, sub) in grown for main, sub in zip(metadata_df['main_category'], metadata_df['sub_category'])]
+    print(f"Only changed: {sum(mask)} of {len(metadata_df)} subcategories were added or grew in the last scan")
+    return metadata_df[mask].reset_index(drop=True)
+
+def crawl_by_metadata(engine_name="auto", workers=1, engine_options=None, phase="interleaved", only_changed=False, ttl_days=30,
+                      queue_spec=None, task_unit="subcategory", policies=None, slice_pages=None):
     """Crawl companies based on metadata file with resume capability"""
+    if phase == "fetch":
+        # Phase 2 only needs the frontier, not the metadata
+        from frontier import fetch_frontier
+        fetch_frontier(engine_name, workers, engine_options)
+        return
+    
     # Load metadata
     try:
         metadata_df = pd.read_excel('output/categories_metadata.xlsx')
@@ -553,14 +1053,52 @@ def crawl_by_metadata():
         print(f"Error loading metadata: {e}")
         return
     
+    if only_changed:
+        metadata_df = filter_grown_subcategories(metadata_df)
+    
+    if phase == "harvest":
+        from frontier import harvest_frontier
+        harvest_frontier(metadata_df, engine_name, engine_options)
+        return
+    
+    if phase == "recrawl":
+        from recrawl import recrawl_by_metadata
+        recrawl_by_metadata(metadata_df, engine_name, engine_options, ttl_days)
+        return
+    
+    if queue_spec:
+        crawl_from_queue(metadata_df, queue_spec, task_unit, engine_name, workers, engine_options)
+        return
+    
     # Load crawled progress
-    progress_df = get_crawled_progress()
+    progress = get_crawled_progress()
+    
+    if workers > 1:
+        from worker_pool import crawl_with_workers
+        crawl_with_workers(metadata_df, progress, workers, engine_name, engine_options, policies)
+        return
+    
+    from background_writer import BackgroundWriter
+    if policies:
+        engine = create_engine(engine_name, **(engine_options or {}))
+        print(f"Using {engine.name} fetch engine")
+        sink = BackgroundWriter()
+        try:
+            crawl_scheduled(engine, metadata_df, policies, slice_pages, sink)
+        except Exception as e:
+            print(f"Error during crawling: {e}")
+        finally:
+            engine.close()
+            sink.close()
+        return
     
     # Find resume position
-    start_idx = find_resume_position(metadata_df, progress_df)
+    start_idx = find_resume_position(metadata_df)
     print(f"Starting from position {start_idx}/{len(metadata_df)}")
     
-    driver = setup_driver()
+    engine = create_engine(engine_name, **(engine_options or {}))
+    print(f"Using {engine.name} fetch engine")
+    sink = BackgroundWriter()
     
     try:
         # Process from resume position onwards
@@ -576,35 +1114,100 @@ def crawl_by_metadata():
             existing_companies = get_existing_companies(main_category)
             
             # Check progress for this specific subcategory
-            progress_mask = (progress_df['main_category'] == main_category) & (progress_df['sub_category'] == sub_category)
-            
-            if progress_mask.any():
-                crawled_count = progress_df.loc[progress_mask, 'number_company_crawled'].iloc[0]
-                if crawled_count >= max_companies:
-                    print(f"  Skipping - already completed ({crawled_count}/{max_companies})")
-                    continue
-                else:
-                    print(f"  Resuming from {crawled_count} to {max_companies}")
-            else:
-                crawled_count = 0
-                print(f"  Starting fresh ({max_companies} companies)")
+            crawled_count = get_subcategory_start(progress, main_category, sub_category, max_companies)
+            if crawled_count is None:
+                continue
             
-            companies = crawl_companies_from_subcategory(
-                driver, main_category, sub_category, max_companies, existing_companies, crawled_count
+            fetched = crawl_companies_from_subcategory(
+                engine, main_category, sub_category, max_companies, existing_companies, crawled_count, sink,
+                main_href=get_stored_url(row, 'main_href'), sub_href=get_stored_url(row, 'sub_href')
             )
             
-            print(f"  Crawled {len(companies)} new companies from {sub_category}")
+            print(f"  Crawled {fetched} new companies from {sub_category}")
             
     except Exception as e:
         print(f"Error during crawling: {e}")
     finally:
-        driver.quit()
+        engine.close()
+        sink.close()
+
+def parse_args():
+    """Parse command line arguments"""
+    from work_queue import DEFAULT_POSTGRES_DSN
+    parser = argparse.ArgumentParser(description="Crawl yellowpages.vn companies from categories_metadata.xlsx")
+    parser.add_argument("--engine", choices=ENGINE_NAMES, default="auto",
+                        help="Fetch engine: http, selenium, or auto (HTTP with per-page Selenium fallback)")
+    parser.add_argument("--max-per-host", type=int, default=8,
+                        help="Concurrent detail page requests per host for the HTTP engine")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of crawler processes, each with its own engine, sharing the subcategory queue")
+    parser.add_argument("--delay", type=float, default=0.5,
+                        help="Base politeness delay in seconds between page loads, raised with observed response times")
+    parser.add_argument("--max-delay", type=float, default=10.0,
+                        help="Upper bound for the adaptive politeness delay in seconds")
+    parser.add_argument("--debug", action="store_true",
+                        help="Print per-field extraction timings (same as CRAWLER_DEBUG=1)")
+    parser.add_argument("--lean", action="store_true",
+                        help="Headless Chrome with eager page load that blocks images, fonts, CSS and trackers")
+    parser.add_argument("--blocklist",
+                        help="File of URL patterns to block in lean mode, one per line (default: built-in list)")
+    parser.add_argument("--phase", choices=PHASES, default="interleaved",
+                        help="interleaved: listing and detail pages together, following \"Tiếp\" one listing page at a time; "
+                             "harvest: listing pages only, into the URL frontier (the only phase that fetches listing pages in parallel); "
+                             "fetch: detail pages of the frontier (uses --workers); "
+                             "recrawl: re-read listing pages, fetch only new, changed or stale companies")
+    parser.add_argument("--queue",
+                        help="Claim work from a leased task queue shared by workers on any host: "
+                             "sqlite (output/crawler.db), a postgresql:// DSN, or auto (CRAWLER_QUEUE_DSN or the compose Postgres, else sqlite)")
+    parser.add_argument("--task-unit", choices=["subcategory", "page"], default="subcategory",
+                        help="With --queue, one task per subcategory or per listing page")
+    parser.add_argument("--schedule", nargs="?", const="gap,staleness,backoff,fair",
+                        help="Order subcategories by comma-separated policies instead of spreadsheet order: "
+                             "gap, staleness, backoff, fair (default when given without a value: all four)")
+    parser.add_argument("--slice-pages", type=int,
+                        help="With --schedule, crawl at most this many listing pages of a subcategory before re-ranking")
+    parser.add_argument("--ttl-days", type=float, default=30,
+                        help="With --phase recrawl, refetch detail pages older than this even when their card is unchanged")
+    parser.add_argument("--only-changed", action="store_true",
+                        help="Only subcategories added or grown in the last scan_metadata.py --diff")
+    parser.add_argument("--postgres-sink", nargs="?", const=DEFAULT_POSTGRES_DSN,
+                        help="Also upsert crawled companies and memberships into Postgres from a background writer "
+                             "(default DSN: the compose Postgres service; sqlite:///path for a local stand-in)")
+    return parser.parse_args()
+
+def handle_sigterm(signum, frame):
+    """Exit through the finally blocks, so queued results are written before the process ends"""
+    print("Received SIGTERM, saving queued results and stopping")
+    raise SystemExit(128 + signum)
 
 def main():
     """Main function"""
     import os
+    import signal
+    args = parse_args()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if args.debug:
+        # Environment variable so worker processes inherit it
+        os.environ["CRAWLER_DEBUG"] = "1"
+    if args.postgres_sink:
+        os.environ["CRAWLER_OUTPUT_DSN"] = args.postgres_sink
     os.makedirs('output', exist_ok=True)
-    crawl_by_metadata()
+    engine_options = {
+        "max_per_host": args.max_per_host,
+        "delay": args.delay,
+        "max_delay": args.max_delay,
+        "lean": args.lean,
+        "blocked_urls": load_blocklist(args.blocklist) if args.blocklist else None,
+    }
+    policies = None
+    if args.schedule:
+        from scheduler import parse_policies
+        policies = parse_policies(args.schedule)
+    try:
+        crawl_by_metadata(args.engine, args.workers, engine_options, args.phase, args.only_changed, args.ttl_days,
+                          args.queue, args.task_unit, policies, args.slice_pages)
+    finally:
+        crawl_store.close_output_sink()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,883 @@
+"""SQLite store for crawled companies and crawl progress checkpoints"""
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import pandas as pd
+
+DB_PATH = 'output/crawler.db'
+
+# Output column -> store column
+COMPANY_COLUMNS = {
+    "Tên công ty": "name",
+    "Địa chỉ": "address",
+    "Điện thoại": "phone",
+    "Hotline": "hotline",
+    "Email": "email",
+    "Website": "website",
+    "Giới thiệu": "intro",
+    "Ngành nghề": "business",
+    "Sản phẩm dịch vụ": "products",
+    "Ngành": "main_category",
+    "Ngành nhỏ": "sub_category",
+    "URL": "url",
+}
+
+# Columns read from the company detail page, compared by recrawl
+DETAIL_COLUMNS = ["Tên công ty", "Địa chỉ", "Điện thoại", "Hotline", "Email", "Website", "Giới thiệu", "Ngành nghề", "Sản phẩm dịch vụ"]
+
+# Export column listing every category a company belongs to
+ALL_CATEGORIES_COLUMN = "Tất cả ngành"
+EXPORT_COLUMNS = list(COMPANY_COLUMNS) + [ALL_CATEGORIES_COLUMN]
+
+# Export column with when a company or its memberships last changed (epoch seconds)
+CHANGED_AT_COLUMN = "Cập nhật"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    address TEXT,
+    phone TEXT,
+    hotline TEXT,
+    email TEXT,
+    website TEXT,
+    intro TEXT,
+    business TEXT,
+    products TEXT,
+    main_category TEXT NOT NULL,
+    sub_category TEXT,
+    url TEXT,
+    crawled_at REAL,
+    fingerprint TEXT,
+    changed_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS progress (
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    number_company_crawled INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    page_url TEXT,
+    page INTEGER,
+    last_order INTEGER,
+    failures INTEGER NOT NULL DEFAULT 0,
+    last_failure_at REAL,
+    PRIMARY KEY (main_category, sub_category)
+);
+
+CREATE INDEX IF NOT EXISTS progress_updated_at ON progress (updated_at);
+
+CREATE INDEX IF NOT EXISTS companies_url ON companies (url);
+
+-- A company is its URL; companies imported from old workbooks have none and go by name
+CREATE UNIQUE INDEX IF NOT EXISTS companies_url_key ON companies (url) WHERE url != '';
+CREATE UNIQUE INDEX IF NOT EXISTS companies_legacy_key ON companies (main_category, name) WHERE url = '';
+
+CREATE TABLE IF NOT EXISTS memberships (
+    company_url TEXT NOT NULL,
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    order_num INTEGER,
+    seen_at REAL,
+    PRIMARY KEY (company_url, main_category, sub_category)
+);
+
+CREATE INDEX IF NOT EXISTS memberships_category ON memberships (main_category, sub_category);
+
+CREATE TABLE IF NOT EXISTS completed_pages (
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    page_url TEXT,
+    completed_at REAL,
+    PRIMARY KEY (main_category, sub_category, page)
+);
+
+CREATE TABLE IF NOT EXISTS frontier (
+    url TEXT PRIMARY KEY,
+    name TEXT,
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    order_num INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS frontier_status ON frontier (status);
+
+CREATE TABLE IF NOT EXISTS frontier_memberships (
+    company_url TEXT NOT NULL,
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    order_num INTEGER,
+    PRIMARY KEY (company_url, main_category, sub_category)
+);
+
+CREATE TABLE IF NOT EXISTS harvest_progress (
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    page_url TEXT,
+    page INTEGER,
+    cards INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (main_category, sub_category)
+);
+
+CREATE TABLE IF NOT EXISTS listing_cards (
+    company_url TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    seen_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS metadata_scans (
+    scanned_at REAL PRIMARY KEY,
+    subcategories INTEGER NOT NULL,
+    changes INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS metadata_changes (
+    scanned_at REAL NOT NULL,
+    main_category TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    change TEXT NOT NULL,
+    old_number_website INTEGER,
+    new_number_website INTEGER,
+    PRIMARY KEY (scanned_at, main_category, sub_category)
+);
+
+CREATE TABLE IF NOT EXISTS export_watermarks (
+    name TEXT PRIMARY KEY,
+    watermark REAL NOT NULL
+);
+"""
+
+# Columns added after the first release of a table: (table, column, definition)
+MIGRATIONS = [
+    ("progress", "page_url", "TEXT"),
+    ("progress", "page", "INTEGER"),
+    ("progress", "last_order", "INTEGER"),
+    ("progress", "failures", "INTEGER NOT NULL DEFAULT 0"),
+    ("progress", "last_failure_at", "REAL"),
+    ("companies", "fingerprint", "TEXT"),
+    ("companies", "changed_at", "REAL"),
+]
+
+PROGRESS_FILE = 'output/metadata_crawled.xlsx'
+
+_connection = None
+_connection_pid = None
+_dedup_index = None
+_dedup_index_pid = None
+_output_sink = None
+_output_sink_pid = None
+
+def connect(db_path=DB_PATH):
+    """Open the store in WAL mode and create missing tables"""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    migrate(conn)
+    conn.executescript(SCHEMA)
+    backfill_memberships(conn)
+    return conn
+
+def migrate(conn):
+    """Add columns that older crawler.db files are missing"""
+    for table, column, definition in MIGRATIONS:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if columns and column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    migrate_company_key(conn)
+
+def migrate_company_key(conn):
+    """Rebuild a companies table keyed by (main_category, name) so its URL is the key.
+
+    The old key dropped a second company with the same name in a category.
+    Rows sharing a URL keep the first one stored.
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'companies'").fetchone()
+    if not row or "UNIQUE (main_category, name)" not in row[0]:
+        return
+    columns = ", ".join(["id"] + list(COMPANY_COLUMNS.values()) + ["crawled_at", "fingerprint", "changed_at"])
+    table_sql = re.search(r"CREATE TABLE IF NOT EXISTS companies \(.*?\n\);", SCHEMA, re.S).group(0)
+    with conn:
+        conn.execute(table_sql.replace("companies", "companies_rekeyed", 1))
+        conn.execute(
+            f"""
+            INSERT INTO companies_rekeyed ({columns})
+            SELECT {columns} FROM companies
+            WHERE url IS NULL OR url = '' OR id IN (SELECT MIN(id) FROM companies WHERE url != '' GROUP BY url)
+            """
+        )
+        conn.execute("DROP TABLE companies")
+        conn.execute("ALTER TABLE companies_rekeyed RENAME TO companies")
+    print("Rebuilt the companies table keyed by URL")
+
+def backfill_memberships(conn):
+    """Give companies stored before memberships existed their own category as a membership"""
+    if conn.execute("SELECT 1 FROM memberships LIMIT 1").fetchone():
+        return
+    with conn:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO memberships (company_url, main_category, sub_category, order_num, seen_at)
+            SELECT url, main_category, sub_category, NULL, crawled_at FROM companies WHERE url != ''
+            """
+        )
+
+def get_connection():
+    """Shared connection for this process, reopened after fork"""
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        _connection = connect()
+        _connection_pid = os.getpid()
+        import_excel_files(_connection)
+        import_progress_file(_connection)
+    return _connection
+
+def get_output_sink():
+    """Postgres output sink for this process when CRAWLER_OUTPUT_DSN is set, else None"""
+    global _output_sink, _output_sink_pid
+    dsn = os.environ.get("CRAWLER_OUTPUT_DSN")
+    if not dsn:
+        return None
+    if _output_sink is None or _output_sink_pid != os.getpid():
+        from postgres_sink import PostgresSink
+        _output_sink = PostgresSink(dsn)
+        _output_sink_pid = os.getpid()
+    return _output_sink
+
+def publish(records, memberships=None):
+    """Mirror committed companies and memberships to the output sink, if any"""
+    sink = get_output_sink()
+    if sink is not None:
+        sink.publish(records, memberships)
+
+def close_output_sink():
+    """Flush and stop this process's output sink"""
+    global _output_sink
+    if _output_sink is not None and _output_sink_pid == os.getpid():
+        _output_sink.close()
+    _output_sink = None
+
+def import_excel_files(conn, pattern='output/*_company_details.xlsx'):
+    """One-time import of company workbooks written before the store existed"""
+    if conn.execute("SELECT 1 FROM companies LIMIT 1").fetchone():
+        return
+    for filepath in sorted(glob.glob(pattern)):
+        try:
+            df = pd.read_excel(filepath).fillna("")
+            records = df.to_dict('records')
+            inserted = append_companies(records, conn)
+            print(f"Imported {inserted} companies from {filepath} into {DB_PATH}")
+        except Exception as e:
+            print(f"Error importing {filepath}: {e}")
+
+def import_progress_file(conn, filepath=PROGRESS_FILE):
+    """One-time import of metadata_crawled.xlsx written before the store existed"""
+    if not os.path.exists(filepath) or conn.execute("SELECT 1 FROM progress LIMIT 1").fetchone():
+        return
+    try:
+        progress_df = pd.read_excel(filepath)
+        # Keep file order so the last row stays the most recent checkpoint
+        now = time.time() - len(progress_df)
+        with conn:
+            for i, row in enumerate(progress_df.itertuples(index=False)):
+                write_progress(conn, row.main_category, row.sub_category, int(row.number_company_crawled), now + i)
+        print(f"Imported {len(progress_df)} progress rows from {filepath} into {DB_PATH}")
+    except Exception as e:
+        print(f"Error importing {filepath}: {e}")
+
+def content_hash(text):
+    """Fingerprint of page content, insensitive to whitespace"""
+    return hashlib.sha1(re.sub(r"\s+", " ", text or "").strip().encode("utf-8")).hexdigest()
+
+def record_fingerprint(record):
+    """Fingerprint of a company record's detail page fields (not its category or URL)"""
+    return content_hash("\x1f".join(str(record.get(key) or "") for key in DETAIL_COLUMNS))
+
+def insert_companies(conn, records):
+    """Insert records not stored yet (by URL, or by name without one) inside the caller's transaction, return new row count"""
+    columns = list(COMPANY_COLUMNS.values()) + ["crawled_at", "fingerprint", "changed_at"]
+    placeholders = ", ".join("?" for _ in columns)
+    now = time.time()
+    rows = [
+        [str(record.get(key) or "") for key in COMPANY_COLUMNS] + [now, record_fingerprint(record), now]
+        for record in records
+    ]
+    before = conn.total_changes
+    conn.executemany(
+        f"INSERT INTO companies ({', '.join(columns)}) VALUES ({placeholders})"
+        " ON CONFLICT (url) WHERE url != '' DO NOTHING"
+        " ON CONFLICT (main_category, name) WHERE url = '' DO NOTHING",
+        rows,
+    )
+    return conn.total_changes - before
+
+def write_progress(conn, main_category, sub_category, crawled_count, updated_at=None):
+    """Upsert a progress counter inside the caller's transaction"""
+    conn.execute(
+        """
+        INSERT INTO progress (main_category, sub_category, number_company_crawled, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (main_category, sub_category)
+        DO UPDATE SET number_company_crawled = excluded.number_company_crawled, updated_at = excluded.updated_at
+        """,
+        (main_category, sub_category, int(crawled_count), updated_at or time.time()),
+    )
+
+def write_position(conn, main_category, sub_category, page_url, page, last_order):
+    """Record the listing page and last processed order inside the caller's transaction"""
+    conn.execute(
+        "UPDATE progress SET page_url = ?, page = ?, last_order = ? WHERE main_category = ? AND sub_category = ?",
+        (page_url, page, last_order, main_category, sub_category),
+    )
+
+def append_companies(records, conn=None):
+    """Append company records in one transaction, ignoring ones already stored.
+
+    Cost depends only on the batch size, not on how many companies are stored.
+    Returns the number of new rows.
+    """
+    if not records:
+        return 0
+    conn = conn or get_connection()
+    with conn:
+        inserted = insert_companies(conn, records)
+    publish(records)
+    return inserted
+
+def insert_memberships(conn, memberships):
+    """INSERT OR IGNORE (company_url, main_category, sub_category, order) rows inside the caller's transaction"""
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO memberships (company_url, main_category, sub_category, order_num, seen_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(url, main_category, sub_category, order, now) for url, main_category, sub_category, order in memberships],
+    )
+
+def checkpoint(main_category, sub_category, records, crawled_count, position=None, completed_page=None, memberships=None, completed_pages=(), conn=None):
+    """Commit company records and the subcategory progress counter in one transaction.
+
+    position is (page_url, page, last_order): where to resume. completed_page
+    is (page, page_url) of a listing page that is fully processed;
+    completed_pages adds more of them. memberships are (company_url,
+    main_category, sub_category, order) rows. A crash
+    leaves either all or none of it on disk, so resume never disagrees with
+    what was saved. Returns the number of new company rows.
+    """
+    conn = conn or get_connection()
+    with conn:
+        inserted = insert_companies(conn, records) if records else 0
+        if memberships:
+            insert_memberships(conn, memberships)
+        write_progress(conn, main_category, sub_category, crawled_count)
+        if position is not None:
+            write_position(conn, main_category, sub_category, *position)
+        pages = list(completed_pages) + ([completed_page] if completed_page is not None else [])
+        if pages:
+            conn.executemany(
+                "INSERT OR REPLACE INTO completed_pages (main_category, sub_category, page, page_url, completed_at) VALUES (?, ?, ?, ?, ?)",
+                [(main_category, sub_category, page, page_url, time.time()) for page, page_url in pages],
+            )
+    publish(records, memberships)
+    return inserted
+
+def update_progress(main_category, sub_category, crawled_count, conn=None):
+    """Record the number of companies crawled for a subcategory"""
+    conn = conn or get_connection()
+    with conn:
+        write_progress(conn, main_category, sub_category, crawled_count)
+
+def get_progress(main_category, sub_category, conn=None):
+    """Crawled count for one subcategory (primary key lookup), None if never started"""
+    conn = conn or get_connection()
+    row = conn.execute(
+        "SELECT number_company_crawled FROM progress WHERE main_category = ? AND sub_category = ?",
+        (main_category, sub_category),
+    ).fetchone()
+    return row[0] if row else None
+
+def get_resume_point(main_category, sub_category, conn=None):
+    """(page_url, page, last_order) to resume a subcategory at, or None if not recorded"""
+    conn = conn or get_connection()
+    row = conn.execute(
+        "SELECT page_url, page, last_order FROM progress WHERE main_category = ? AND sub_category = ?",
+        (main_category, sub_category),
+    ).fetchone()
+    if not row or not row[0]:
+        return None
+    page_url, page, last_order = row
+    return page_url, page or 1, last_order or 0
+
+def get_completed_pages(main_category, sub_category, conn=None):
+    """Page numbers of a subcategory's listing pages that are fully processed"""
+    conn = conn or get_connection()
+    rows = conn.execute(
+        "SELECT page FROM completed_pages WHERE main_category = ? AND sub_category = ?",
+        (main_category, sub_category),
+    )
+    return {page for (page,) in rows}
+
+def get_all_progress(conn=None):
+    """{(main_category, sub_category): crawled count} for every started subcategory"""
+    conn = conn or get_connection()
+    rows = conn.execute("SELECT main_category, sub_category, number_company_crawled FROM progress")
+    return {(main_category, sub_category): count for main_category, sub_category, count in rows}
+
+def get_last_progress(conn=None):
+    """(main_category, sub_category, crawled count) of the most recent checkpoint, or None"""
+    conn = conn or get_connection()
+    return conn.execute(
+        "SELECT main_category, sub_category, number_company_crawled FROM progress ORDER BY updated_at DESC LIMIT 1"
+    ).fetchone()
+
+def read_progress(conn=None):
+    """DataFrame of progress in the metadata_crawled.xlsx layout"""
+    conn = conn or get_connection()
+    return pd.read_sql_query(
+        "SELECT main_category, sub_category, number_company_crawled FROM progress ORDER BY updated_at",
+        conn,
+    )
+
+def get_company_names(main_category, conn=None):
+    """Names of companies stored for a main category without a URL (imported from old workbooks)"""
+    conn = conn or get_connection()
+    rows = conn.execute("SELECT name FROM companies WHERE main_category = ? AND url = ''", (main_category,))
+    return {name for (name,) in rows}
+
+def canonical_url(url):
+    """Canonical form of a company detail URL used as its dedup key"""
+    parts = urlsplit(url.strip())
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query) if not key.startswith('utm_')])
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https', parts.netloc.lower(), path, query, ''))
+
+class DedupIndex:
+    """Canonical URLs of every stored company, across all categories and runs.
+
+    The on-disk layer is the indexed url column of the companies table; this
+    keeps an in-memory set on top of it for O(1) lookups before each detail
+    fetch. refresh() pulls in only rows added since the last load, e.g. by
+    other worker processes.
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn
+        self.urls = set()
+        self.last_id = 0
+        self.refresh()
+
+    def refresh(self):
+        conn = self.conn or get_connection()
+        rows = conn.execute("SELECT id, url FROM companies WHERE id > ? AND url != '' ORDER BY id", (self.last_id,))
+        for row_id, url in rows:
+            self.urls.add(url)
+            self.last_id = row_id
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return canonical_url(url) in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, url):
+        self.urls.add(canonical_url(url))
+
+def get_dedup_index():
+    """Shared dedup index for this process"""
+    global _dedup_index, _dedup_index_pid
+    if _dedup_index is None or _dedup_index_pid != os.getpid():
+        _dedup_index = DedupIndex()
+        _dedup_index_pid = os.getpid()
+    return _dedup_index
+
+def get_membership_urls(main_category, sub_category, conn=None):
+    """Company URLs already recorded as members of a subcategory"""
+    conn = conn or get_connection()
+    rows = conn.execute(
+        "SELECT company_url FROM memberships WHERE main_category = ? AND sub_category = ?",
+        (main_category, sub_category),
+    )
+    return {url for (url,) in rows}
+
+def get_main_categories(conn=None):
+    """Main categories that have stored companies or memberships"""
+    conn = conn or get_connection()
+    rows = conn.execute(
+        "SELECT main_category FROM companies UNION SELECT main_category FROM memberships ORDER BY main_category"
+    )
+    return [category for (category,) in rows]
+
+def iter_companies(main_category=None, changed_since=None, with_changed_at=False, batch_size=10000, conn=None):
+    """Yield lists of company rows in EXPORT_COLUMNS order, batch_size at a time.
+
+    Streams from the store without loading everything: all companies, or
+    those of a main category (stored under it, or listed in it through a
+    membership). The "Tất cả ngành" column lists every 'main - sub'
+    category a company belongs to. With changed_since, only companies
+    changed or given a membership after that time. with_changed_at appends
+    the CHANGED_AT_COLUMN value to each row.
+    """
+    conn = conn or get_connection()
+    columns = ", ".join(f"c.{column}" for column in COMPANY_COLUMNS.values())
+    changed_at = "COALESCE(c.changed_at, c.crawled_at, 0)"
+    conditions = []
+    params = []
+    if main_category is not None:
+        conditions.append("(c.main_category = ? OR c.url IN (SELECT company_url FROM memberships WHERE main_category = ?))")
+        params += [main_category, main_category]
+    if changed_since is not None:
+        conditions.append(f"({changed_at} > ? OR c.url IN (SELECT company_url FROM memberships WHERE seen_at > ?))")
+        params += [changed_since, changed_since]
+    cursor = conn.execute(
+        f"""
+        SELECT {columns},
+               (SELECT group_concat(m.main_category || ' - ' || m.sub_category, '; ')
+                FROM memberships m WHERE m.company_url = c.url)
+               {f", MAX({changed_at}, COALESCE((SELECT MAX(m.seen_at) FROM memberships m WHERE m.company_url = c.url), 0))" if with_changed_at else ""}
+        FROM companies c
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY c.id
+        """,
+        params,
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+def add_to_frontier(main_category, sub_category, cards, position, done=False, conn=None):
+    """Record one harvested listing page in one transaction.
+
+    cards are (name, href, order) tuples; each URL enters the frontier once,
+    under the first category it was seen in, and every listing is kept as a
+    frontier membership. position is (next page_url, page) to resume the
+    harvest at. Returns the number of URLs new to the frontier.
+    """
+    conn = conn or get_connection()
+    now = time.time()
+    with conn:
+        before = conn.total_changes
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO frontier (url, name, main_category, sub_category, order_num, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(canonical_url(href), name, main_category, sub_category, order, now) for name, href, order in cards],
+        )
+        added = conn.total_changes - before
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO frontier_memberships (company_url, main_category, sub_category, order_num)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(canonical_url(href), main_category, sub_category, order) for name, href, order in cards],
+        )
+        page_url, page = position
+        conn.execute(
+            """
+            INSERT INTO harvest_progress (main_category, sub_category, page_url, page, cards, done, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (main_category, sub_category)
+            DO UPDATE SET page_url = excluded.page_url, page = excluded.page,
+                          cards = harvest_progress.cards + excluded.cards,
+                          done = excluded.done, updated_at = excluded.updated_at
+            """,
+            (main_category, sub_category, page_url, page, len(cards), int(done), now),
+        )
+    return added
+
+def get_harvest_progress(main_category, sub_category, conn=None):
+    """(page_url, page, cards, done) of a subcategory's harvest, or None if never started"""
+    conn = conn or get_connection()
+    return conn.execute(
+        "SELECT page_url, page, cards, done FROM harvest_progress WHERE main_category = ? AND sub_category = ?",
+        (main_category, sub_category),
+    ).fetchone()
+
+def get_frontier_counts(conn=None):
+    """{status: number of URLs} for the frontier"""
+    conn = conn or get_connection()
+    rows = conn.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status")
+    return {status: count for status, count in rows}
+
+def get_pending_frontier(limit=None, max_attempts=3, conn=None):
+    """(url, name, main_category, sub_category, order) of frontier URLs still to fetch, in harvest order"""
+    conn = conn or get_connection()
+    query = "SELECT url, name, main_category, sub_category, order_num FROM frontier WHERE status = 'pending' AND attempts < ? ORDER BY rowid"
+    params = [max_attempts]
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def complete_frontier(records, done_urls, failed_urls, max_attempts=3, conn=None):
+    """Commit fetched companies and settle their frontier URLs in one transaction.
+
+    records are fetched company records; done_urls are fetched or already
+    stored URLs, whose frontier memberships become memberships and count
+    toward subcategory progress; failed_urls get another attempt until
+    max_attempts. Returns the number of new company rows.
+    """
+    conn = conn or get_connection()
+    now = time.time()
+    memberships = []
+    with conn:
+        inserted = insert_companies(conn, records) if records else 0
+        if done_urls:
+            if get_output_sink() is not None:
+                memberships = conn.execute(
+                    f"""
+                    SELECT company_url, main_category, sub_category, order_num FROM frontier_memberships
+                    WHERE company_url IN ({", ".join("?" for _ in done_urls)})
+                    """,
+                    list(done_urls),
+                ).fetchall()
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO memberships (company_url, main_category, sub_category, order_num, seen_at)
+                SELECT company_url, main_category, sub_category, order_num, ? FROM frontier_memberships WHERE company_url = ?
+                """,
+                [(now, url) for url in done_urls],
+            )
+            conn.executemany("UPDATE frontier SET status = 'done', updated_at = ? WHERE url = ?", [(now, url) for url in done_urls])
+            touched = conn.execute(
+                f"""
+                SELECT DISTINCT main_category, sub_category FROM frontier_memberships
+                WHERE company_url IN ({", ".join("?" for _ in done_urls)})
+                """,
+                list(done_urls),
+            ).fetchall()
+            write_membership_progress(conn, touched)
+        if failed_urls:
+            conn.executemany(
+                """
+                UPDATE frontier SET attempts = attempts + 1, updated_at = ?,
+                       status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                WHERE url = ?
+                """,
+                [(now, max_attempts, url) for url in failed_urls],
+            )
+    publish(records, memberships)
+    return inserted
+
+def write_membership_progress(conn, categories):
+    """Raise progress counters to the number of memberships, inside the caller's transaction"""
+    for main_category, sub_category in categories:
+        (count,) = conn.execute(
+            "SELECT COUNT(*) FROM memberships WHERE main_category = ? AND sub_category = ?",
+            (main_category, sub_category),
+        ).fetchone()
+        if count > (get_progress(main_category, sub_category, conn) or 0):
+            write_progress(conn, main_category, sub_category, count)
+
+def attach_frontier_memberships(conn=None):
+    """Turn frontier memberships of already fetched URLs into memberships.
+
+    Covers listings harvested after their company was fetched under another
+    category. Returns the number of memberships added.
+    """
+    conn = conn or get_connection()
+    with conn:
+        before = conn.total_changes
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO memberships (company_url, main_category, sub_category, order_num, seen_at)
+            SELECT fm.company_url, fm.main_category, fm.sub_category, fm.order_num, ?
+            FROM frontier_memberships fm JOIN frontier f ON f.url = fm.company_url
+            WHERE f.status = 'done'
+            """,
+            (time.time(),),
+        )
+        added = conn.total_changes - before
+        if added:
+            write_membership_progress(conn, conn.execute("SELECT DISTINCT main_category, sub_category FROM frontier_memberships").fetchall())
+    return added
+
+def record_metadata_changes(changes, subcategories, conn=None):
+    """Store one scan's (main, sub, change, old count, new count) rows and reopen grown harvests.
+
+    Subcategories that were added or grew lose their finished harvest, so
+    the next --phase harvest walks their listing pages again.
+    """
+    conn = conn or get_connection()
+    now = time.time()
+    with conn:
+        conn.execute(
+            "INSERT INTO metadata_scans (scanned_at, subcategories, changes) VALUES (?, ?, ?)",
+            (now, subcategories, len(changes)),
+        )
+        conn.executemany(
+            """
+            INSERT INTO metadata_changes (scanned_at, main_category, sub_category, change, old_number_website, new_number_website)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(now,) + tuple(change) for change in changes],
+        )
+        conn.executemany(
+            "DELETE FROM harvest_progress WHERE main_category = ? AND sub_category = ?",
+            [(main_category, sub_category) for main_category, sub_category, change, old, new in changes
+             if change == "added" or (change == "count_changed" and new > old)],
+        )
+    return now
+
+def get_grown_subcategories(conn=None):
+    """(main_category, sub_category) pairs added or grown in the most recent scan, None if no scan was recorded"""
+    conn = conn or get_connection()
+    if not conn.execute("SELECT 1 FROM metadata_scans LIMIT 1").fetchone():
+        return None
+    rows = conn.execute(
+        """
+        SELECT main_category, sub_category FROM metadata_changes
+        WHERE scanned_at = (SELECT MAX(scanned_at) FROM metadata_scans)
+          AND (change = 'added' OR (change = 'count_changed' AND new_number_website > old_number_website))
+        """
+    )
+    return set(rows)
+
+def get_card_fingerprints(urls, conn=None):
+    """{company_url: listing card fingerprint} for the given canonical URLs"""
+    conn = conn or get_connection()
+    urls = list(urls)
+    if not urls:
+        return {}
+    rows = conn.execute(
+        f"SELECT company_url, fingerprint FROM listing_cards WHERE company_url IN ({', '.join('?' for _ in urls)})",
+        urls,
+    )
+    return dict(rows)
+
+def get_crawled_at(urls, conn=None):
+    """{url: time its detail page was last fetched} for the given canonical URLs that are stored"""
+    conn = conn or get_connection()
+    urls = list(urls)
+    if not urls:
+        return {}
+    rows = conn.execute(
+        f"SELECT url, MAX(crawled_at) FROM companies WHERE url IN ({', '.join('?' for _ in urls)}) GROUP BY url",
+        urls,
+    )
+    return dict(rows)
+
+def recrawl_page(main_category, sub_category, new_records, refreshed_records, memberships, card_fingerprints, conn=None):
+    """Commit one recrawled listing page in one transaction.
+
+    new_records are companies not stored before; refreshed_records are
+    re-fetched stored companies, updated in place when their detail
+    fingerprint changed. card_fingerprints is {company_url: fingerprint} of
+    the cards that no longer need a fetch. Returns (inserted, changed).
+    """
+    conn = conn or get_connection()
+    now = time.time()
+    assignments = ", ".join(f"{COMPANY_COLUMNS[label]} = ?" for label in DETAIL_COLUMNS)
+    with conn:
+        inserted = insert_companies(conn, new_records) if new_records else 0
+        changed_records = []
+        for record in refreshed_records:
+            fingerprint = record_fingerprint(record)
+            before = conn.total_changes
+            conn.execute(
+                f"""
+                UPDATE companies SET {assignments}, fingerprint = ?, changed_at = ?, crawled_at = ?
+                WHERE url = ? AND fingerprint IS NOT ?
+                """,
+                [str(record.get(label) or "") for label in DETAIL_COLUMNS] + [fingerprint, now, now, record["URL"], fingerprint],
+            )
+            if conn.total_changes > before:
+                changed_records.append(record)
+            else:
+                conn.execute("UPDATE companies SET crawled_at = ? WHERE url = ?", (now, record["URL"]))
+        if memberships:
+            insert_memberships(conn, memberships)
+            write_membership_progress(conn, [(main_category, sub_category)])
+        conn.executemany(
+            """
+            INSERT INTO listing_cards (company_url, fingerprint, seen_at) VALUES (?, ?, ?)
+            ON CONFLICT (company_url) DO UPDATE SET fingerprint = excluded.fingerprint, seen_at = excluded.seen_at
+            """,
+            [(url, fingerprint, now) for url, fingerprint in card_fingerprints.items()],
+        )
+    publish(new_records + changed_records, memberships)
+    return inserted, len(changed_records)
+
+def commit_page(main_category, sub_category, records, memberships, conn=None):
+    """Commit one listing page's companies and memberships, raising the progress counter to match.
+
+    Used by listing page tasks, which have no resume position. Returns the
+    number of new company rows.
+    """
+    conn = conn or get_connection()
+    with conn:
+        inserted = insert_companies(conn, records) if records else 0
+        if memberships:
+            insert_memberships(conn, memberships)
+        write_membership_progress(conn, [(main_category, sub_category)])
+    publish(records, memberships)
+    return inserted
+
+def get_schedule_state(conn=None):
+    """{(main_category, sub_category): (crawled count, updated_at, failures, last_failure_at)}"""
+    conn = conn or get_connection()
+    rows = conn.execute(
+        "SELECT main_category, sub_category, number_company_crawled, updated_at, failures, last_failure_at FROM progress"
+    )
+    return {(main_category, sub_category): tuple(state) for main_category, sub_category, *state in rows}
+
+def record_schedule_failure(main_category, sub_category, conn=None):
+    """Count a scheduled slice that made no progress, return the consecutive failure count.
+
+    Leaves updated_at alone: it is the time of the last progress, which
+    resume and the staleness policy sort by.
+    """
+    conn = conn or get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO progress (main_category, sub_category, number_company_crawled, failures, last_failure_at)
+            VALUES (?, ?, 0, 1, ?)
+            ON CONFLICT (main_category, sub_category)
+            DO UPDATE SET failures = progress.failures + 1, last_failure_at = excluded.last_failure_at
+            """,
+            (main_category, sub_category, time.time()),
+        )
+        (failures,) = conn.execute(
+            "SELECT failures FROM progress WHERE main_category = ? AND sub_category = ?",
+            (main_category, sub_category),
+        ).fetchone()
+    return failures
+
+def clear_schedule_failures(main_category, sub_category, conn=None):
+    """Reset the failure count after a slice made progress"""
+    conn = conn or get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE progress SET failures = 0, last_failure_at = NULL WHERE main_category = ? AND sub_category = ?",
+            (main_category, sub_category),
+        )
+
+def get_export_watermark(name, conn=None):
+    """Time up to which an incremental export has written changes, or None"""
+    conn = conn or get_connection()
+    row = conn.execute("SELECT watermark FROM export_watermarks WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def set_export_watermark(name, watermark, conn=None):
+    conn = conn or get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO export_watermarks (name, watermark) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET watermark = excluded.watermark",
+            (name, watermark),
+        )
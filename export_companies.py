@@ -0,0 +1,155 @@
+import argparse
+import os
+import re
+
+import crawl_store
+from crawl_by_metadata import normalize_filename
+
+# Excel's row limit per sheet, header included
+MAX_SHEET_ROWS = 1048576
+ALL_CATEGORIES_FILE = 'output/all_company_details.xlsx'
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+def sheet_title(name, used):
+    """Valid, unique sheet title (at most 31 characters)"""
+    base = " ".join(INVALID_SHEET_CHARS.sub(" ", name).split())[:31] or "Sheet"
+    title = base
+    number = 2
+    while title.lower() in used:
+        suffix = f" ({number})"
+        title = base[:31 - len(suffix)] + suffix
+        number += 1
+    used.add(title.lower())
+    return title
+
+def write_category_sheets(workbook, main_category, used_titles, title=None):
+    """Stream a main category's companies into write-only sheets, starting a new sheet at MAX_SHEET_ROWS"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    title = title or main_category
+    sheet = None
+    sheet_rows = 0
+    total = 0
+    for rows in crawl_store.iter_companies(main_category):
+        for row in rows:
+            if sheet is None or sheet_rows >= MAX_SHEET_ROWS:
+                sheet = workbook.create_sheet(sheet_title(title, used_titles))
+                sheet.append(crawl_store.EXPORT_COLUMNS)
+                sheet_rows = 1
+            # Control characters from scraped text are not allowed in xlsx
+            sheet.append([ILLEGAL_CHARACTERS_RE.sub("", value) if isinstance(value, str) else value for value in row])
+            sheet_rows += 1
+            total += 1
+    if sheet is None:
+        # Header-only sheet, like an empty DataFrame export
+        workbook.create_sheet(sheet_title(title, used_titles)).append(crawl_store.EXPORT_COLUMNS)
+    return total
+
+def save_workbook(workbook, filepath):
+    """Save next to the target and rename, so readers never open a half-written file"""
+    tmp_path = f"{filepath}.tmp"
+    workbook.save(tmp_path)
+    os.replace(tmp_path, filepath)
+
+def export_category(main_category):
+    """Write output/<category>_company_details.xlsx from the company store.
+
+    Rows are streamed into an openpyxl write-only workbook, so memory stays
+    flat however many companies the category has; past Excel's row limit the
+    rows continue on "Companies (2)", "Companies (3)", ...
+    """
+    from openpyxl import Workbook
+    filename = normalize_filename(main_category)
+    filepath = f'output/{filename}_company_details.xlsx'
+
+    workbook = Workbook(write_only=True)
+    total = write_category_sheets(workbook, main_category, set(), "Companies")
+    save_workbook(workbook, filepath)
+    print(f"Exported {total} companies to {filepath}")
+    return filepath
+
+def export_category_safely(main_category):
+    try:
+        return export_category(main_category)
+    except Exception as e:
+        print(f"Error exporting {main_category}: {e}")
+
+def export_all(categories=None, jobs=1):
+    """Export every main category in the store, or only the given ones, jobs workbooks at a time"""
+    categories = categories or crawl_store.get_main_categories()
+    if jobs <= 1:
+        for main_category in categories:
+            export_category_safely(main_category)
+        return
+
+    import multiprocessing as mp
+    with mp.Pool(jobs) as pool:
+        for _ in pool.imap_unordered(export_category_safely, categories):
+            pass
+
+def export_single_workbook(categories=None, filepath=ALL_CATEGORIES_FILE):
+    """Write one workbook with a sheet per main category, split at Excel's row limit"""
+    from openpyxl import Workbook
+    categories = categories or crawl_store.get_main_categories()
+    workbook = Workbook(write_only=True)
+    used_titles = set()
+    total = 0
+    for main_category in categories:
+        count = write_category_sheets(workbook, main_category, used_titles)
+        print(f"  {main_category}: {count} companies")
+        total += count
+    save_workbook(workbook, filepath)
+    print(f"Exported {total} company rows in {len(categories)} categories to {filepath}")
+    return filepath
+
+def export_progress():
+    """Write metadata_crawled.xlsx from the progress checkpoints"""
+    progress_df = crawl_store.read_progress()
+    progress_df.to_excel(crawl_store.PROGRESS_FILE, index=False)
+    print(f"Exported progress for {len(progress_df)} subcategories to {crawl_store.PROGRESS_FILE}")
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Export crawled companies from the store to per-category xlsx files")
+    parser.add_argument("--category", action="append",
+                        help="Main category to export (repeatable, default: all)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of category workbooks written in parallel")
+    parser.add_argument("--single-workbook", action="store_true",
+                        help=f"Write {ALL_CATEGORIES_FILE} instead, one sheet per main category")
+    parser.add_argument("--progress", action="store_true",
+                        help="Also write metadata_crawled.xlsx from the progress checkpoints")
+    parser.add_argument("--parquet", action="store_true",
+                        help="Instead of xlsx files, append companies changed since the last export to output/companies_parquet")
+    parser.add_argument("--parquet-rebuild", action="store_true",
+                        help="Rewrite output/companies_parquet from the whole store")
+    parser.add_argument("--compact", action="store_true",
+                        help="Merge the Parquet dataset's small files and row groups into one file per category")
+    parser.add_argument("--postgres", metavar="DSN",
+                        help="Instead of xlsx files, upsert the whole store into the Postgres output tables "
+                             "(sqlite:///path for a local stand-in)")
+    return parser.parse_args()
+
+def main():
+    """Main function"""
+    args = parse_args()
+    os.makedirs('output', exist_ok=True)
+    if args.postgres:
+        from postgres_sink import load_store
+        load_store(args.postgres)
+        return
+    if args.parquet or args.parquet_rebuild or args.compact:
+        from parquet_dataset import compact_parquet, export_parquet
+        if args.parquet or args.parquet_rebuild:
+            export_parquet(rebuild=args.parquet_rebuild)
+        if args.compact:
+            compact_parquet()
+        return
+    if args.single_workbook:
+        export_single_workbook(args.category)
+    else:
+        export_all(args.category, args.jobs)
+    if args.progress:
+        export_progress()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Browserless fetch engine for yellowpages.vn listing and detail pages"""
+import re
+import time
+import asyncio
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import html as lxml_html
+
+BASE_URL = "https://www.yellowpages.vn/"
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Selectors shared with the Selenium extraction in crawl_by_metadata.py
+LISTING_CONTAINER_SELECTOR = ".rounded-4.border.bg-white.shadow-sm.mb-3.pb-4"
+COMPANY_LINK_SELECTOR = ".yp_noidunglistings .fs-5.pb-0.text-capitalize a"
+ORDER_SELECTOR = ".yp_sothutu .yp_sothutu_txt small"
+# Card content used for recrawl fingerprints (excludes the order number, which shifts)
+CARD_CONTENT_SELECTOR = ".yp_noidunglistings"
+# Responses that mean the server wants us to slow down
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class PolitenessDelay:
+    """Delay between page loads, scaled by observed response times.
+
+    The delay is base_delay plus factor times the smoothed response time,
+    capped at max_delay: a slow, loaded server gets more breathing room.
+    429 and 5xx responses double an extra backoff, halved again by each
+    normal response.
+
+    Concurrent async fetches are paced per host as a start rate instead:
+    max_in_flight starts per base_delay plus backoff, so up to max_in_flight
+    requests overlap and slow responses throttle them through the in-flight
+    cap rather than through the delay.
+    """
+
+    def __init__(self, base_delay=0.5, factor=1.0, max_delay=10.0, smoothing=0.3):
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.smoothing = smoothing
+        self.average_response = 0.0
+        self.backoff = 0.0
+        self.delay = base_delay
+        self.last_request = 0.0
+        self.next_start = {}  # host -> earliest start of its next async request
+
+    def wait(self):
+        """Sleep until the current delay has passed since the last request"""
+        remaining = self.last_request + self.delay - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    async def wait_async(self, host, max_in_flight=1):
+        """Sleep until host's next start slot: one every (base_delay + backoff) / max_in_flight seconds"""
+        interval = min(self.max_delay, self.base_delay + self.backoff) / max_in_flight
+        now = time.monotonic()
+        start = max(now, self.next_start.get(host, 0.0))
+        self.next_start[host] = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def observe(self, elapsed, status=None):
+        """Record a response time and status and recompute the delay"""
+        if self.average_response:
+            self.average_response += self.smoothing * (elapsed - self.average_response)
+        else:
+            self.average_response = elapsed
+        if status in THROTTLE_STATUSES:
+            self.backoff = min(self.max_delay, max(2 * self.backoff, self.base_delay, 0.5))
+        else:
+            self.backoff /= 2
+        self.delay = min(self.max_delay, self.base_delay + self.factor * self.average_response + self.backoff)
+        self.last_request = time.monotonic()
+
+
+def create_session(pool_size=10):
+    """Create a pooled HTTP session with retries for transient errors"""
+    session = requests.Session()
+    # Return the last throttled response instead of raising, so the pacer sees its status
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=list(THROTTLE_STATUSES), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
+    })
+    return session
+
+
+def element_text(element):
+    """Visible text of an element, whitespace collapsed like WebElement.text"""
+    if element is None:
+        return ""
+    parts = element.xpath(".//text()[not(ancestor::script) and not(ancestor::style)]")
+    return re.sub(r"\s+", " ", " ".join(parts)).strip()
+
+
+def first_match(root, selector):
+    """Return the first element matching a CSS selector or None"""
+    matches = root.cssselect(selector)
+    return matches[0] if matches else None
+
+
+def decode_page(content, charset=None):
+    """Text of a page body, decoded with its Content-Type charset (the site serves UTF-8 otherwise)"""
+    try:
+        return content.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+
+
+def header_charset(content_type):
+    """charset parameter of a Content-Type header, or None"""
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.I)
+    return match.group(1) if match else None
+
+
+def parse_html(page_html):
+    """lxml tree of a decoded page; an XML declaration's encoding no longer applies"""
+    return lxml_html.fromstring(re.sub(r"^\s*<\?xml[^>]*\?>", "", page_html))
+
+
+def split_category_name(category_name):
+    """Split 'main - sub' category name into its two parts"""
+    category_parts = category_name.split(' - ', 1)
+    main_category = category_parts[0] if len(category_parts) > 0 else ""
+    sub_category = category_parts[1] if len(category_parts) > 1 else ""
+    return main_category, sub_category
+
+
+def parse_listing_cards(containers, page_url, card_texts=None):
+    """Parse (name, href, order) tuples from listing containers, collecting card text by href"""
+    company_data = []
+    for i, container in enumerate(containers):
+        company_link = first_match(container, COMPANY_LINK_SELECTOR)
+        if company_link is None:
+            continue
+        name = element_text(company_link)
+        href = company_link.get("href")
+        if not (name and href):
+            continue
+        try:
+            order_num = int(element_text(first_match(container, ORDER_SELECTOR)))
+        except ValueError:
+            order_num = i + 1  # Use index as fallback
+        company_data.append((name, urljoin(page_url, href), order_num))
+        if card_texts is not None:
+            content = first_match(container, CARD_CONTENT_SELECTOR)
+            card_texts[urljoin(page_url, href)] = element_text(content if content is not None else container)
+    return company_data
+
+
+def parse_company_listing(page_html, page_url, card_texts=None):
+    """Equivalent of get_company_data_with_order for raw listing HTML.
+
+    When card_texts is a dict, it is filled with each card's text by
+    absolute href, for recrawl fingerprints.
+    """
+    root = parse_html(page_html)
+
+    # Same three strategies as the Selenium version: div_listing, bare containers, bare links
+    div_listing = first_match(root, ".div_listing")
+    if div_listing is not None:
+        company_data = parse_listing_cards(div_listing.cssselect(LISTING_CONTAINER_SELECTOR), page_url, card_texts)
+        if company_data:
+            return company_data
+
+    company_data = parse_listing_cards(root.cssselect(LISTING_CONTAINER_SELECTOR), page_url, card_texts)
+    if company_data:
+        return company_data
+
+    company_data = []
+    for i, link in enumerate(root.cssselect(COMPANY_LINK_SELECTOR)):
+        name = element_text(link)
+        href = link.get("href")
+        if name and href:
+            company_data.append((name, urljoin(page_url, href), i + 1))
+            if card_texts is not None:
+                card_texts[urljoin(page_url, href)] = name
+    return company_data
+
+
+def parse_next_page_link(page_html, page_url):
+    """Return absolute URL of the 'Tiếp' link in #paging, or None"""
+    root = parse_html(page_html)
+    for link in root.cssselect("#paging a"):
+        if element_text(link) == "Tiếp":
+            href = link.get("href")
+            if href and href != "#":
+                return urljoin(page_url, href)
+    return None
+
+
+def parse_category_links(page_html, page_url, selector):
+    """Return (text, absolute href) for every link matching selector"""
+    root = parse_html(page_html)
+    links = []
+    for link in root.cssselect(selector):
+        href = link.get("href")
+        if href:
+            links.append((element_text(link), urljoin(page_url, href)))
+    return links
+
+
+def parse_company_detail(page_html, category_name):
+    """Equivalent of extract_company_detail for raw detail page HTML.
+
+    Returns None when the page has none of the expected fields, so the caller
+    can fall back to the Selenium engine.
+    """
+    root = parse_html(page_html)
+
+    name = element_text(first_match(root, ".fs-3.text-capitalize"))
+    elements = root.cssselect(".m-0.pb-2")
+    if not name and not elements:
+        return None
+
+    address = element_text(elements[0]) if elements else ""
+
+    phone = ""
+    hotline = ""
+    if len(elements) > 1:
+        fw_elements = elements[1].cssselect(".fw-semibold.fs18")
+        if fw_elements:
+            phone = element_text(fw_elements[0])
+        if len(fw_elements) > 1:
+            hotline = element_text(fw_elements[1])
+
+    email = ""
+    if len(elements) > 2:
+        email = element_text(first_match(elements[2], "a"))
+
+    website = element_text(first_match(root, ".m-0.fs18"))
+
+    intro = ""
+    for h2 in root.cssselect(".yp_h2_border"):
+        if "giới thiệu công ty" in element_text(h2).lower():
+            intro_parts = [element_text(sibling) for sibling in h2.itersiblings()]
+            intro = " ".join(part for part in intro_parts if part)
+            break
+
+    business = element_text(first_match(root, ".yp_div_nganh_thitruong"))
+
+    product_texts = []
+    for class_name in [".yp_div_sanphamdichvu1", ".yp_div_sanphamdichvu2"]:
+        element = first_match(root, class_name)
+        if element is not None:
+            product_texts.append(element_text(element))
+    products = " ".join(product_texts)
+
+    main_category, sub_category = split_category_name(category_name)
+
+    return {
+        "Tên công ty": name,
+        "Địa chỉ": address,
+        "Điện thoại": phone,
+        "Hotline": hotline,
+        "Email": email,
+        "Website": website,
+        "Giới thiệu": intro,
+        "Ngành nghề": business,
+        "Sản phẩm dịch vụ": products,
+        "Ngành": main_category,
+        "Ngành nhỏ": sub_category
+    }
+
+
+async def fetch_page_async(session, semaphores, url, timeout, retries=2, pacer=None, max_per_host=1):
+    """Download one page while holding its host's slot, its text or None on failure.
+
+    With a pacer, every attempt waits for its host's next start slot (paced
+    for max_per_host requests in flight) and reports its response time and
+    status.
+    """
+    host = urlparse(url).netloc
+    async with semaphores[host]:
+        for attempt in range(retries + 1):
+            try:
+                if pacer:
+                    await pacer.wait_async(host, max_per_host)
+                start = time.monotonic()
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    if pacer:
+                        pacer.observe(time.monotonic() - start, response.status)
+                    if response.status in THROTTLE_STATUSES and attempt < retries:
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+                        continue
+                    response.raise_for_status()
+                    return decode_page(await response.read(), response.charset)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == retries:
+                    print(f"    HTTP error fetching {url}: {e}")
+                    return None
+                await asyncio.sleep(0.5 * 2 ** attempt)
+    return None
+
+
+async def fetch_detail_async(session, semaphores, url, category_name, timeout, retries=2, pacer=None, max_per_host=1):
+    """Fetch and parse one detail page while holding its host's slot"""
+    page_html = await fetch_page_async(session, semaphores, url, timeout, retries, pacer, max_per_host)
+    if page_html is None:
+        return None
+    return parse_company_detail(page_html, category_name)
+
+
+def create_async_session(urls, max_per_host=8):
+    """aiohttp session plus one semaphore per host of urls, capped at max_per_host"""
+    semaphores = {}
+    for url in urls:
+        host = urlparse(url).netloc
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(max_per_host)
+    connector = aiohttp.TCPConnector(limit_per_host=max_per_host)
+    headers = {"User-Agent": USER_AGENT, "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8"}
+    return aiohttp.ClientSession(connector=connector, headers=headers), semaphores
+
+
+async def fetch_company_details_async(company_data, category_name, max_per_host=8, timeout=20, pacer=None):
+    """Fetch detail pages for (name, href, order) tuples concurrently.
+
+    At most max_per_host requests are in flight per host. Returns
+    (name, href, order, company_info) tuples sorted by order; company_info
+    is None for pages that failed or parsed empty.
+    """
+    session, semaphores = create_async_session([href for _, href, _ in company_data], max_per_host)
+    async with session:
+        details = await asyncio.gather(*[
+            fetch_detail_async(session, semaphores, href, category_name, timeout, pacer=pacer, max_per_host=max_per_host)
+            for name, href, order in company_data
+        ])
+
+    results = [(name, href, order, company_info) for (name, href, order), company_info in zip(company_data, details)]
+    return sorted(results, key=lambda result: result[2])
+
+
+async def fetch_pages_async(urls, max_per_host=8, timeout=20, pacer=None):
+    """Download pages concurrently, returning their HTML (None on failure) in urls order"""
+    session, semaphores = create_async_session(urls, max_per_host)
+    async with session:
+        return await asyncio.gather(*[
+            fetch_page_async(session, semaphores, url, timeout, pacer=pacer, max_per_host=max_per_host)
+            for url in urls
+        ])
+
+
+def fetch_company_details(company_data, category_name, max_per_host=8, timeout=20, pacer=None):
+    """Blocking wrapper around fetch_company_details_async"""
+    if not company_data:
+        return []
+    return asyncio.run(fetch_company_details_async(company_data, category_name, max_per_host, timeout, pacer))
+
+
+class HttpEngine:
+    """Fetch engine backed by a pooled requests session and lxml parsing"""
+
+    name = "http"
+
+    def __init__(self, pool_size=10, timeout=20, max_per_host=8, pacer=None):
+        self.session = create_session(pool_size)
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.pacer = pacer or PolitenessDelay()
+        self._last_listing = (None, None)  # (url, html) of the last listing page
+        self.card_texts = {}  # href -> card text of the last listing page(s)
+
+    def fetch(self, url):
+        """Download a page and return its decoded HTML, or None on failure"""
+        self.pacer.wait()
+        start = time.monotonic()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            self.pacer.observe(time.monotonic() - start, response.status_code)
+            response.raise_for_status()
+            return decode_page(response.content, header_charset(response.headers.get("Content-Type")))
+        except requests.RequestException as e:
+            print(f"    HTTP error fetching {url}: {e}")
+            return None
+
+    def find_links(self, url, selector):
+        """Return (text, href) for links matching selector on url"""
+        page_html = self.fetch(url)
+        if page_html is None:
+            return []
+        return parse_category_links(page_html, url, selector)
+
+    def find_links_many(self, urls, selector):
+        """find_links for several pages fetched concurrently, in urls order"""
+        if not urls:
+            return []
+        pages = asyncio.run(fetch_pages_async(urls, self.max_per_host, self.timeout, self.pacer))
+        return [parse_category_links(page_html, url, selector) if page_html else [] for url, page_html in zip(urls, pages)]
+
+    def load_listing(self, url):
+        """Fetch a listing page and return its (name, href, order) tuples"""
+        page_html = self.fetch(url)
+        if page_html is None:
+            return []
+        self._last_listing = (url, page_html)
+        self.card_texts = {}
+        company_data = parse_company_listing(page_html, url, self.card_texts)
+        print(f"    Total company data extracted: {len(company_data)}")
+        return company_data
+
+    def next_page_link(self, page_url):
+        """Return the next listing page URL for page_url, or None"""
+        last_url, page_html = self._last_listing
+        if last_url != page_url:
+            page_html = self.fetch(page_url)
+        if page_html is None:
+            return None
+        return parse_next_page_link(page_html, page_url)
+
+    def load_listings(self, urls):
+        """Fetch listing pages concurrently, returning their (name, href, order) lists in urls order"""
+        if not urls:
+            return []
+        pages = asyncio.run(fetch_pages_async(urls, self.max_per_host, self.timeout, self.pacer))
+        self._last_listing = (urls[-1], pages[-1])
+        self.card_texts = {}
+        return [parse_company_listing(page_html, url, self.card_texts) if page_html else [] for url, page_html in zip(urls, pages)]
+
+    def load_detail(self, url, category_name):
+        """Fetch and parse a company detail page"""
+        page_html = self.fetch(url)
+        if page_html is None:
+            return None
+        return parse_company_detail(page_html, category_name)
+
+    def load_details(self, company_data, category_name):
+        """Fetch detail pages for a listing concurrently, ordered by order"""
+        return fetch_company_details(company_data, category_name, self.max_per_host, self.timeout, self.pacer)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,312 @@
+"""Two-phase crawl: harvest a deduplicated frontier of detail URLs, then fetch it"""
+import math
+import multiprocessing as mp
+import queue
+
+import crawl_store
+from crawl_by_metadata import create_engine, get_stored_url, resolve_subcategory_url
+
+# Frontier URLs fetched and committed together
+FETCH_BATCH_SIZE = 50
+
+# Companies per listing page, and listing pages fetched together while harvesting
+LISTING_PAGE_SIZE = 45
+HARVEST_WINDOW = 16
+
+def listing_page_url(base_subcategory_url, page):
+    """URL of a subcategory listing page; page 1 is the bare subcategory URL"""
+    return f"{base_subcategory_url}?page={page}" if page > 1 else base_subcategory_url
+
+def iter_listing_pages(engine, main_category, sub_category, max_companies, sub_href, main_href=None, page=1):
+    """Yield (page, page_url, next_page_url, company_data) for a subcategory's listing pages in order.
+
+    Pages up to ceil(max_companies / 45) are generated directly and fetched
+    HARVEST_WINDOW at a time (concurrently with the HTTP engine); pages past
+    that are only fetched one by one, when the caller keeps asking. Stops
+    after the first empty page. A stored sub_href that returns no listings
+    is re-resolved once through the category pages.
+    """
+    resolved = False
+    base_subcategory_url = sub_href
+    last_page = max(page, math.ceil(max_companies / LISTING_PAGE_SIZE))
+
+    while True:
+        if page <= last_page:
+            pages = list(range(page, min(last_page, page + HARVEST_WINDOW - 1) + 1))
+            print(f"    Pages {pages[0]}-{pages[-1]} of {last_page}...")
+        else:
+            # More companies than the expected pages held - verify overflow pages lazily
+            pages = [page]
+            print(f"    Checking overflow page {page}...")
+        listings = engine.load_listings([listing_page_url(base_subcategory_url, p) for p in pages])
+
+        if not listings[0] and not resolved:
+            # Stored URL returned no listings - re-resolve through the category pages once
+            resolved = True
+            print(f"    No listings at {base_subcategory_url}, re-resolving")
+            sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+            if sub_href and sub_href != base_subcategory_url:
+                base_subcategory_url = sub_href
+                continue
+        resolved = True
+
+        for p, company_data in zip(pages, listings):
+            yield p, listing_page_url(base_subcategory_url, p), listing_page_url(base_subcategory_url, p + 1), company_data
+            if not company_data:
+                return
+        page = pages[-1] + 1
+
+def harvest_subcategory(engine, main_category, sub_category, max_companies, main_href=None, sub_href=None):
+    """Fetch a subcategory's listing pages and add every card to the frontier.
+
+    Pages are committed in order, each with the position of the next one,
+    so a restart continues at the first page not yet harvested. Returns the
+    number of URLs new to the frontier.
+    """
+    harvest = crawl_store.get_harvest_progress(main_category, sub_category)
+    if harvest and harvest[3]:
+        print(f"  Skipping - already harvested ({harvest[2]} cards)")
+        return 0
+
+    if not sub_href:
+        sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+        if not sub_href:
+            return 0
+
+    if harvest and harvest[1]:
+        page, cards = harvest[1], harvest[2]
+        print(f"    Resuming harvest at page {page}")
+    else:
+        page, cards = 1, 0
+
+    added = 0
+    for page, page_url, next_page_url, company_data in iter_listing_pages(engine, main_category, sub_category, max_companies, sub_href, main_href, page):
+        if not company_data:
+            print(f"    No companies found on page {page}")
+            crawl_store.add_to_frontier(main_category, sub_category, [], (page_url, page), done=True)
+            break
+
+        # Stop at the listed company count, like the interleaved crawl
+        company_data = company_data[:max(0, max_companies - cards)]
+        cards += len(company_data)
+        finished = cards >= max_companies
+        position = (page_url, page) if finished else (next_page_url, page + 1)
+        new_urls = crawl_store.add_to_frontier(main_category, sub_category, company_data, position, finished)
+        added += new_urls
+        print(f"    Page {page}: {len(company_data)} cards, {new_urls} new URLs ({cards}/{max_companies})")
+        if finished:
+            break
+
+    return added
+
+def crawl_listing_page(engine, main_category, sub_category, page, max_companies, main_href=None, sub_href=None,
+                       work_queue=None, task=None):
+    """Crawl one listing page as a self-contained task: listing, new detail pages, memberships.
+
+    Returns follow-up (main, sub, page, number_website, main_href, sub_href)
+    tasks: the next page when the last expected page was full but the
+    subcategory is still short. Raises when detail pages failed, after
+    committing the rest, so the task is retried. With the work queue, the
+    page's count is saved on its task and the subcategory total is summed
+    over the page tasks of every host; otherwise the local progress is used.
+    """
+    if not sub_href:
+        sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+        if not sub_href:
+            raise RuntimeError(f"Subcategory '{sub_category}' not found")
+
+    page_url = listing_page_url(sub_href, page)
+    company_data = engine.load_listing(page_url)
+    if not company_data:
+        print(f"    No companies found on page {page}")
+        return None
+
+    seen_urls = crawl_store.get_dedup_index()
+    seen_urls.refresh()
+    member_urls = crawl_store.get_membership_urls(main_category, sub_category)
+
+    memberships = []
+    pending = []
+    for name, href, order in company_data:
+        url_key = crawl_store.canonical_url(href)
+        if url_key in member_urls:
+            continue
+        if href in seen_urls:
+            # Fetched under another category - attach the membership without a page load
+            memberships.append((url_key, main_category, sub_category, order))
+            continue
+        pending.append((name, href, order))
+
+    records = []
+    failed = 0
+    for name, href, order, company_info in engine.load_details(pending, f"{main_category} - {sub_category}"):
+        if company_info:
+            url_key = crawl_store.canonical_url(href)
+            company_info["URL"] = url_key
+            records.append(company_info)
+            memberships.append((url_key, main_category, sub_category, order))
+            seen_urls.add(href)
+            print(f"      ✓ #{order} {name}")
+        else:
+            failed += 1
+            print(f"      ✗ #{order} {name}")
+
+    inserted = crawl_store.commit_page(main_category, sub_category, records, memberships)
+    print(f"    Page {page}: {len(company_data)} cards, {inserted} new companies, {len(memberships) - len(records)} memberships attached")
+    if failed:
+        raise RuntimeError(f"{failed} detail pages failed on page {page}")
+
+    if work_queue is not None:
+        # Cards on this page now counted for the subcategory, wherever they were stored
+        work_queue.save_progress(task, len(company_data))
+        crawled_count = work_queue.subcategory_crawled(main_category, sub_category)
+    else:
+        crawled_count = crawl_store.get_progress(main_category, sub_category) or 0
+    if page >= math.ceil(max_companies / LISTING_PAGE_SIZE) and len(company_data) >= LISTING_PAGE_SIZE and crawled_count < max_companies:
+        return [(main_category, sub_category, page + 1, max_companies, main_href, sub_href)]
+    return None
+
+def harvest_frontier(metadata_df, engine_name="auto", engine_options=None):
+    """Phase 1: fill the frontier from every subcategory's listing pages"""
+    engine = create_engine(engine_name, **(engine_options or {}))
+    print(f"Harvesting listing pages with the {engine.name} fetch engine")
+    try:
+        for idx, row in metadata_df.iterrows():
+            main_category = row['main_category']
+            sub_category = row['sub_category']
+            print(f"\n[{idx+1}/{len(metadata_df)}] Harvesting: {main_category} - {sub_category}")
+            try:
+                added = harvest_subcategory(
+                    engine, main_category, sub_category, int(row['number_website']),
+                    get_stored_url(row, 'main_href'), get_stored_url(row, 'sub_href')
+                )
+                print(f"  Added {added} URLs to the frontier")
+            except Exception as e:
+                print(f"  Error harvesting subcategory: {e}")
+    finally:
+        engine.close()
+    print(f"\nFrontier: {crawl_store.get_frontier_counts()}")
+
+def fetch_frontier_batch(engine, batch):
+    """Fetch one batch of frontier rows, returning (records, done_urls, failed_urls)"""
+    seen_urls = crawl_store.get_dedup_index()
+    seen_urls.refresh()
+
+    records = []
+    done_urls = []
+    failed_urls = []
+    groups = {}
+    for url, name, main_category, sub_category, order in batch:
+        if url in seen_urls:
+            # Stored by an interleaved crawl - only its memberships are missing
+            done_urls.append(url)
+            continue
+        groups.setdefault((main_category, sub_category), []).append((name, url, order))
+
+    for (main_category, sub_category), company_data in groups.items():
+        try:
+            results = engine.load_details(company_data, f"{main_category} - {sub_category}")
+        except Exception as e:
+            print(f"      ✗ Error fetching {len(company_data)} pages from {sub_category}: {e}")
+            failed_urls.extend(url for _, url, _ in company_data)
+            continue
+        for name, url, order, company_info in results:
+            if company_info:
+                company_info["URL"] = url
+                records.append(company_info)
+                done_urls.append(url)
+                seen_urls.add(url)
+                print(f"      ✓ {name}")
+            else:
+                failed_urls.append(url)
+                print(f"      ✗ {name}")
+    return records, done_urls, failed_urls
+
+def get_frontier_batches(batch_size=FETCH_BATCH_SIZE):
+    """Split the pending frontier into batches, reporting the total up front"""
+    pending = crawl_store.get_pending_frontier()
+    counts = crawl_store.get_frontier_counts()
+    print(f"Frontier: {sum(counts.values())} URLs, {len(pending)} to fetch ({counts})")
+    return [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+def fetch_frontier(engine_name="auto", workers=1, engine_options=None, batch_size=FETCH_BATCH_SIZE):
+    """Phase 2: fetch every pending frontier URL, committing one batch at a time"""
+    attached = crawl_store.attach_frontier_memberships()
+    if attached:
+        print(f"Attached {attached} memberships of already fetched companies")
+    batches = get_frontier_batches(batch_size)
+    if workers > 1:
+        fetch_with_workers(batches, workers, engine_name, engine_options)
+    else:
+        engine = create_engine(engine_name, **(engine_options or {}))
+        print(f"Using {engine.name} fetch engine")
+        try:
+            for i, batch in enumerate(batches):
+                print(f"\n[{i+1}/{len(batches)}] Fetching {len(batch)} detail pages")
+                records, done_urls, failed_urls = fetch_frontier_batch(engine, batch)
+                crawl_store.complete_frontier(records, done_urls, failed_urls)
+        except Exception as e:
+            print(f"Error during fetching: {e}")
+        finally:
+            engine.close()
+    print(f"\nFrontier: {crawl_store.get_frontier_counts()}")
+
+def fetch_worker(worker_id, task_queue, result_queue, engine_name, engine_options):
+    """Fetch frontier batches from the task queue until it is drained"""
+    engine = None
+    try:
+        engine = create_engine(engine_name, **engine_options)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            idx, total, batch = task
+            print(f"\n[worker {worker_id}] [{idx+1}/{total}] Fetching {len(batch)} detail pages")
+            result_queue.put(("batch",) + fetch_frontier_batch(engine, batch))
+    except Exception as e:
+        print(f"[worker {worker_id}] Error during fetching: {e}")
+    finally:
+        if engine is not None:
+            engine.close()
+        result_queue.put(("done", worker_id))
+
+def fetch_with_workers(batches, workers, engine_name="auto", engine_options=None):
+    """Fetch frontier batches with N worker processes; all writes are done here"""
+    task_queue = mp.Queue()
+    result_queue = mp.Queue()
+    for idx, batch in enumerate(batches):
+        task_queue.put((idx, len(batches), batch))
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = []
+    for worker_id in range(1, workers + 1):
+        process = mp.Process(
+            target=fetch_worker,
+            args=(worker_id, task_queue, result_queue, engine_name, engine_options or {}),
+        )
+        process.start()
+        processes.append(process)
+
+    running = workers
+    try:
+        while running > 0:
+            try:
+                message = result_queue.get(timeout=5)
+            except queue.Empty:
+                # Stop waiting if every worker died without reporting back
+                if not any(process.is_alive() for process in processes):
+                    print("All workers exited unexpectedly")
+                    break
+                continue
+
+            if message[0] == "batch":
+                crawl_store.complete_frontier(*message[1:])
+            elif message[0] == "done":
+                running -= 1
+                print(f"Worker {message[1]} finished ({running} still running)")
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,155 @@
+"""Parquet dataset of companies, partitioned by main category (Ngành)"""
+import glob
+import os
+import shutil
+import time
+import uuid
+from urllib.parse import quote
+
+import crawl_store
+
+DATASET_DIR = 'output/companies_parquet'
+PARTITION_COLUMN = "Ngành"
+CATEGORICAL_COLUMNS = ["Ngành", "Ngành nhỏ"]
+ROW_GROUP_SIZE = 50000
+# Rows buffered per category before an incremental export writes a row group
+MIN_ROW_GROUP_SIZE = 5000
+WATERMARK_NAME = "parquet"
+# Changes committed up to this long before an export started may still be in flight; read them again next time
+WATERMARK_OVERLAP = 60
+
+def dataset_schema():
+    """Arrow schema: strings, dictionary-encoded categories, and the change time"""
+    import pyarrow as pa
+    fields = []
+    for column in crawl_store.EXPORT_COLUMNS:
+        if column in CATEGORICAL_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    fields.append(pa.field(crawl_store.CHANGED_AT_COLUMN, pa.timestamp("ms")))
+    return pa.schema(fields)
+
+def partition_dir(main_category):
+    """Hive-style directory of a main category, e.g. Ngành=%C4%90%E1%BB%93%20Gia%20D%E1%BB%A5ng"""
+    return os.path.join(DATASET_DIR, f"{PARTITION_COLUMN}={quote(main_category, safe='')}")
+
+def file_schema():
+    """Schema of the files: the partition column lives in the directory name"""
+    schema = dataset_schema()
+    return schema.remove(schema.get_field_index(PARTITION_COLUMN))
+
+def to_record_batch(rows, schema):
+    """Record batch from store rows (EXPORT_COLUMNS plus the change time)"""
+    import pyarrow as pa
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if field.name == crawl_store.CHANGED_AT_COLUMN:
+            arrays.append(pa.array([int((value or 0) * 1000) for value in values], pa.int64()).cast(field.type))
+        elif pa.types.is_dictionary(field.type):
+            arrays.append(pa.array([value or "" for value in values], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array([value or "" for value in values], pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def export_parquet(rebuild=False, batch_size=ROW_GROUP_SIZE):
+    """Append companies changed since the last export to the dataset, one new file per category.
+
+    The first export (or rebuild=True) writes every company. Rows are
+    streamed from the store and written as row groups of at least
+    MIN_ROW_GROUP_SIZE rows per category. A company changed again is
+    appended again; readers and compact_parquet() keep its latest row.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if rebuild and os.path.isdir(DATASET_DIR):
+        shutil.rmtree(DATASET_DIR)
+    since = None if rebuild or not os.path.isdir(DATASET_DIR) else crawl_store.get_export_watermark(WATERMARK_NAME)
+    started_at = time.time()
+    schema = dataset_schema()
+    partition_index = crawl_store.EXPORT_COLUMNS.index(PARTITION_COLUMN)
+    basename = f"part-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+    writers = {}  # main category -> (writer, hidden path, final path)
+    pending = {}  # main category -> rows not written yet
+    written = 0
+
+    def write_group(main_category):
+        if main_category not in writers:
+            directory = partition_dir(main_category)
+            os.makedirs(directory, exist_ok=True)
+            # Hidden name until closed, so readers never see half a file
+            hidden_path = os.path.join(directory, f"_{basename}")
+            writers[main_category] = (pq.ParquetWriter(hidden_path, file_schema()), hidden_path, os.path.join(directory, basename))
+        table = pa.Table.from_batches([to_record_batch(pending.pop(main_category), schema)]).drop_columns([PARTITION_COLUMN])
+        writers[main_category][0].write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    try:
+        for rows in crawl_store.iter_companies(changed_since=since, with_changed_at=True, batch_size=batch_size):
+            for row in rows:
+                pending.setdefault(row[partition_index], []).append(row)
+            written += len(rows)
+            for main_category in [category for category, category_rows in pending.items() if len(category_rows) >= MIN_ROW_GROUP_SIZE]:
+                write_group(main_category)
+        for main_category in list(pending):
+            write_group(main_category)
+    finally:
+        for writer, hidden_path, path in writers.values():
+            writer.close()
+            os.replace(hidden_path, path)
+
+    crawl_store.set_export_watermark(WATERMARK_NAME, started_at - WATERMARK_OVERLAP)
+    print(f"Wrote {written} {'changed ' if since is not None else ''}companies to {DATASET_DIR} ({len(writers)} categories)")
+    return written
+
+def open_dataset():
+    import pyarrow.dataset as ds
+    return ds.dataset(DATASET_DIR, format="parquet", partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+
+def latest_rows(df):
+    """Keep the most recent row of every company URL (rows without a URL are all kept)"""
+    if "URL" not in df or crawl_store.CHANGED_AT_COLUMN not in df:
+        return df
+    df = df.sort_values(crawl_store.CHANGED_AT_COLUMN, kind="stable")
+    keep = (df["URL"] == "") | ~df["URL"].duplicated(keep="last")
+    return df[keep].sort_index()
+
+def read_category(main_category, columns=None):
+    """DataFrame of a main category's companies, reading only the given columns"""
+    import pyarrow.dataset as ds
+    wanted = list(columns) if columns else None
+    read = None if wanted is None else list(dict.fromkeys(wanted + ["URL", crawl_store.CHANGED_AT_COLUMN]))
+    df = latest_rows(open_dataset().to_table(columns=read, filter=ds.field(PARTITION_COLUMN) == main_category).to_pandas())
+    return df[wanted].reset_index(drop=True) if wanted else df.reset_index(drop=True)
+
+def needs_compaction(files):
+    """More than one file, or more row groups than the rows need"""
+    import pyarrow.parquet as pq
+    if len(files) > 1:
+        return True
+    metadata = pq.ParquetFile(files[0]).metadata
+    return metadata.num_row_groups > -(-metadata.num_rows // ROW_GROUP_SIZE)
+
+def compact_parquet():
+    """Rewrite every category made of several files or small row groups as one file, dropping superseded rows"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    schema = file_schema()
+    compacted = 0
+    for partition_dir in sorted(glob.glob(os.path.join(DATASET_DIR, "*=*"))):
+        files = sorted(glob.glob(os.path.join(partition_dir, "*.parquet")))
+        if not files or not needs_compaction(files):
+            continue
+        df = latest_rows(ds.dataset(files, schema=schema, format="parquet").to_table().to_pandas())
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        # Hidden name until complete, so readers never see half a file
+        tmp_path = os.path.join(partition_dir, "_compacting.parquet")
+        pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp_path, os.path.join(partition_dir, f"compacted-{uuid.uuid4().hex[:8]}.parquet"))
+        for path in files:
+            os.remove(path)
+        compacted += 1
+        print(f"Compacted {len(files)} files into one ({table.num_rows} rows): {partition_dir}")
+    print(f"Compacted {compacted} categories in {DATASET_DIR}")
+    return compacted
@@ -0,0 +1,260 @@
+"""Postgres output for crawled companies and their category memberships.
+
+Records are buffered and flushed by a background thread: COPY into a staging
+table, then INSERT ... ON CONFLICT upserts into crawler_companies and
+crawler_memberships, so n8n workflows can query fresh data directly. A
+sqlite:///path DSN writes the same tables to SQLite instead (executemany in
+place of COPY), for local runs without Postgres.
+"""
+import csv
+import io
+import queue
+import sqlite3
+import threading
+import time
+
+import crawl_store
+
+# Output column -> table column, without the URL (the primary key)
+COMPANY_FIELDS = {label: column for label, column in crawl_store.COMPANY_COLUMNS.items() if column != "url"}
+COMPANY_TABLE_COLUMNS = ["url"] + list(COMPANY_FIELDS.values())
+MEMBERSHIP_TABLE_COLUMNS = ["company_url", "main_category", "sub_category", "order_num"]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS crawler_companies (
+        url TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        address TEXT,
+        phone TEXT,
+        hotline TEXT,
+        email TEXT,
+        website TEXT,
+        intro TEXT,
+        business TEXT,
+        products TEXT,
+        main_category TEXT,
+        sub_category TEXT,
+        first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS crawler_memberships (
+        company_url TEXT NOT NULL,
+        main_category TEXT NOT NULL,
+        sub_category TEXT NOT NULL,
+        order_num INTEGER,
+        seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (company_url, main_category, sub_category)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS crawler_companies_updated_at ON crawler_companies (updated_at)",
+    "CREATE INDEX IF NOT EXISTS crawler_memberships_category ON crawler_memberships (main_category, sub_category)",
+]
+
+COMPANY_UPSERT = f"""
+INSERT INTO crawler_companies ({", ".join(COMPANY_TABLE_COLUMNS)})
+SELECT {", ".join(COMPANY_TABLE_COLUMNS)} FROM crawler_companies_staging WHERE true
+ON CONFLICT (url) DO UPDATE SET
+    {", ".join(f"{column} = excluded.{column}" for column in COMPANY_FIELDS.values())},
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+MEMBERSHIP_UPSERT = f"""
+INSERT INTO crawler_memberships ({", ".join(MEMBERSHIP_TABLE_COLUMNS)})
+SELECT {", ".join(MEMBERSHIP_TABLE_COLUMNS)} FROM crawler_memberships_staging WHERE true
+ON CONFLICT (company_url, main_category, sub_category) DO UPDATE SET order_num = excluded.order_num
+"""
+
+def company_rows(records):
+    """Table rows for company records with a URL, last record per URL wins"""
+    rows = {}
+    for record in records:
+        url = record.get("URL")
+        if url:
+            rows[url] = [url] + [str(record.get(label) or "") for label in COMPANY_FIELDS]
+    return list(rows.values())
+
+def membership_rows(memberships):
+    """Table rows for (company_url, main_category, sub_category, order) tuples, one per key"""
+    rows = {}
+    for company_url, main_category, sub_category, order in memberships:
+        rows[(company_url, main_category, sub_category)] = [company_url, main_category, sub_category, order]
+    return list(rows.values())
+
+class PostgresOutput:
+    """Connection plus COPY-and-upsert flushes into the crawler_* tables"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.is_sqlite = dsn.startswith("sqlite:///")
+        self.conn = None
+
+    def connect(self):
+        if self.is_sqlite:
+            conn = sqlite3.connect(self.dsn[len("sqlite:///"):], timeout=30)
+        else:
+            import psycopg2
+            conn = psycopg2.connect(self.dsn, connect_timeout=5)
+        cursor = conn.cursor()
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        for table in ("crawler_companies", "crawler_memberships"):
+            cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table}_staging AS SELECT * FROM {table} WHERE false")
+        conn.commit()
+        return conn
+
+    def copy_rows(self, cursor, table, columns, rows):
+        """Bulk load rows into a staging table"""
+        if self.is_sqlite:
+            placeholders = ", ".join("?" for _ in columns)
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def flush(self, records, memberships):
+        """Upsert companies and memberships in one transaction"""
+        if self.conn is None:
+            self.conn = self.connect()
+        companies = company_rows(records)
+        members = membership_rows(memberships)
+        cursor = self.conn.cursor()
+        try:
+            if companies:
+                self.copy_rows(cursor, "crawler_companies_staging", COMPANY_TABLE_COLUMNS, companies)
+                cursor.execute(COMPANY_UPSERT)
+                cursor.execute("DELETE FROM crawler_companies_staging")
+            if members:
+                self.copy_rows(cursor, "crawler_memberships_staging", MEMBERSHIP_TABLE_COLUMNS, members)
+                cursor.execute(MEMBERSHIP_UPSERT)
+                cursor.execute("DELETE FROM crawler_memberships_staging")
+            self.conn.commit()
+        except Exception:
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+            # Reconnect on the next flush in case the connection is gone
+            self.close()
+            raise
+        return len(companies), len(members)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+class PostgresSink:
+    """Buffer published records and flush them to Postgres on a background thread.
+
+    publish() only puts the batch on a queue, so the crawl loop never waits
+    for the database. The writer merges batches by URL and flushes every
+    batch_size rows or flush_interval seconds; a failed flush keeps its rows
+    for the next try. While max_pending unflushed rows are waiting, the
+    writer stops taking batches, so publish() blocks once max_queued
+    batches are queued, until the database accepts a flush again.
+    """
+
+    def __init__(self, dsn, batch_size=500, flush_interval=2.0, max_queued=1000, max_pending=20000):
+        self.output = PostgresOutput(dsn)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.stopping = threading.Event()
+        self.full_waits = 0
+        self.thread = threading.Thread(target=self.run, name="postgres-sink", daemon=True)
+        self.thread.start()
+
+    def publish(self, records, memberships=None):
+        """Queue company records and (url, main, sub, order) memberships for the next flush"""
+        records = [record for record in records or [] if record.get("URL")]
+        memberships = list(memberships or [])
+        if not (records or memberships):
+            return
+        try:
+            self.queue.put_nowait((records, memberships))
+        except queue.Full:
+            # Back-pressure: Postgres is slower than the crawl, or down
+            self.full_waits += 1
+            print(f"    Postgres queue full ({self.queue.maxsize} batches), waiting for a flush")
+            self.queue.put((records, memberships))
+
+    def run(self):
+        records = {}  # URL -> latest record not flushed yet
+        memberships = {}  # (company_url, main_category, sub_category) -> membership not flushed yet
+        last_flush = time.monotonic()
+        closing = False
+        while not closing or records or memberships:
+            if not closing:
+                if len(records) + len(memberships) < self.max_pending or self.stopping.is_set():
+                    try:
+                        item = self.queue.get(timeout=self.flush_interval)
+                        if item is None:
+                            closing = True
+                        else:
+                            for record in item[0]:
+                                records[record["URL"]] = record
+                            for membership in item[1]:
+                                memberships[tuple(membership[:3])] = membership
+                    except queue.Empty:
+                        pass
+                else:
+                    # Buffer full: leave batches queued until a flush gets through
+                    self.stopping.wait(self.flush_interval)
+
+            pending = len(records) + len(memberships)
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if pending and (closing or due or pending >= self.batch_size):
+                try:
+                    companies, members = self.output.flush(list(records.values()), list(memberships.values()))
+                    print(f"    Postgres: upserted {companies} companies, {members} memberships")
+                    records, memberships = {}, {}
+                except Exception as e:
+                    print(f"    Postgres flush failed, will retry: {e}")
+                    if closing:
+                        print(f"    Postgres: gave up on {pending} rows; export_companies.py --postgres loads them from the store")
+                        break
+                last_flush = time.monotonic()
+        self.output.close()
+
+    def close(self):
+        """Flush everything still buffered and stop the writer"""
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join()
+        if self.full_waits:
+            print(f"Postgres queue was full {self.full_waits} times; the database is the bottleneck")
+
+def load_store(dsn, batch_size=5000):
+    """Upsert every company and membership of the local store into the output tables"""
+    output = PostgresOutput(dsn)
+    conn = crawl_store.get_connection()
+    try:
+        columns = ", ".join(f'{column} AS "{label}"' for label, column in crawl_store.COMPANY_COLUMNS.items())
+        cursor = conn.execute(f"SELECT {columns} FROM companies WHERE url != '' ORDER BY id")
+        labels = [description[0] for description in cursor.description]
+        total = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            total += output.flush([dict(zip(labels, row)) for row in rows], [])[0]
+
+        cursor = conn.execute("SELECT company_url, main_category, sub_category, order_num FROM memberships")
+        members = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            members += output.flush([], rows)[1]
+        print(f"Loaded {total} companies and {members} memberships into {dsn}")
+    finally:
+        output.close()
@@ -0,0 +1,139 @@
+"""Incremental recrawl: re-read listing pages, fetch only new, changed or stale companies"""
+import re
+import time
+
+import crawl_store
+from crawl_by_metadata import create_engine, get_stored_url, resolve_subcategory_url
+from frontier import iter_listing_pages
+
+# Detail pages older than this are fetched again even when their card is unchanged
+DEFAULT_TTL_DAYS = 30
+
+def card_fingerprint(text):
+    """Fingerprint of a listing card's text that both engines agree on.
+
+    The HTTP engine joins text nodes with spaces, while Selenium's innerText
+    keeps inline runs together, breaks lines between blocks and applies
+    text-capitalize, so whitespace and case are dropped before hashing.
+    """
+    return crawl_store.content_hash(re.sub(r"\s+", "", text or "").casefold())
+
+def select_changed_cards(company_data, card_texts, ttl_seconds):
+    """Split listing cards into (to_fetch, unchanged_fingerprints).
+
+    A card is fetched when its company is not stored yet, its card
+    fingerprint differs from the last run, or its detail page is older than
+    the TTL. A fresh company whose card was never fingerprinted only records
+    the fingerprint as its baseline. Returns (name, href, order, reason)
+    tuples to fetch and {company_url: fingerprint} of the cards that need
+    nothing.
+    """
+    url_keys = {href: crawl_store.canonical_url(href) for _, href, _ in company_data}
+    stored_cards = crawl_store.get_card_fingerprints(url_keys.values())
+    crawled_at = crawl_store.get_crawled_at(url_keys.values())
+    stale_before = time.time() - ttl_seconds
+
+    to_fetch = []
+    unchanged = {}
+    for name, href, order in company_data:
+        url_key = url_keys[href]
+        card_text = card_texts.get(href, name)
+        fingerprint = card_fingerprint(card_text)
+        if url_key not in crawled_at:
+            reason = "new"
+        # Fingerprints stored before card_fingerprint hashed the collapsed text
+        elif url_key in stored_cards and stored_cards[url_key] not in (fingerprint, crawl_store.content_hash(card_text)):
+            reason = "card changed"
+        elif (crawled_at[url_key] or 0) < stale_before:
+            reason = "stale"
+        else:
+            unchanged[url_key] = fingerprint
+            continue
+        to_fetch.append((name, href, order, reason))
+    return to_fetch, unchanged
+
+def recrawl_subcategory(engine, main_category, sub_category, max_companies, main_href=None, sub_href=None, ttl_days=DEFAULT_TTL_DAYS):
+    """Re-read a subcategory's listing pages and refresh what changed.
+
+    Returns (fetched, inserted, changed) counts.
+    """
+    if not sub_href:
+        sub_href = resolve_subcategory_url(engine, main_category, sub_category, main_href)
+        if not sub_href:
+            return 0, 0, 0
+
+    category_name = f"{main_category} - {sub_category}"
+    ttl_seconds = ttl_days * 86400
+    cards = fetched = inserted = changed = 0
+
+    for page, page_url, next_page_url, company_data in iter_listing_pages(engine, main_category, sub_category, max_companies, sub_href, main_href):
+        if not company_data:
+            print(f"    No companies found on page {page}")
+            break
+
+        company_data = company_data[:max(0, max_companies - cards)]
+        cards += len(company_data)
+        card_texts = engine.card_texts
+        to_fetch, unchanged = select_changed_cards(company_data, card_texts, ttl_seconds)
+        print(f"    Page {page}: {len(company_data)} cards, {len(unchanged)} unchanged, {len(to_fetch)} to fetch")
+
+        memberships = [(crawl_store.canonical_url(href), main_category, sub_category, order) for _, href, order in company_data]
+        new_records = []
+        refreshed_records = []
+        try:
+            results = engine.load_details([(name, href, order) for name, href, order, _ in to_fetch], category_name)
+        except Exception as e:
+            print(f"      ✗ Error fetching page {page} details: {e}")
+            results = []
+
+        reasons = {href: reason for _, href, _, reason in to_fetch}
+        for name, href, order, company_info in results:
+            if not company_info:
+                print(f"      ✗ #{order} {name}")
+                continue
+            url_key = crawl_store.canonical_url(href)
+            company_info["URL"] = url_key
+            if reasons[href] == "new":
+                new_records.append(company_info)
+            else:
+                refreshed_records.append(company_info)
+            # Card is settled once its detail page is stored
+            unchanged[url_key] = card_fingerprint(card_texts.get(href, name))
+            print(f"      ✓ #{order} {name} ({reasons[href]})")
+
+        fetched += len(new_records) + len(refreshed_records)
+        # Cards whose fetch failed keep their old fingerprint and are retried next run
+        memberships = [membership for membership in memberships if membership[0] in unchanged]
+        page_inserted, page_changed = crawl_store.recrawl_page(
+            main_category, sub_category, new_records, refreshed_records, memberships, unchanged
+        )
+        inserted += page_inserted
+        changed += page_changed
+
+        if cards >= max_companies:
+            break
+
+    return fetched, inserted, changed
+
+def recrawl_by_metadata(metadata_df, engine_name="auto", engine_options=None, ttl_days=DEFAULT_TTL_DAYS):
+    """Recrawl every subcategory in the metadata, fetching only what changed"""
+    engine = create_engine(engine_name, **(engine_options or {}))
+    print(f"Recrawling with the {engine.name} fetch engine (TTL {ttl_days} days)")
+    totals = [0, 0, 0]
+    try:
+        for idx, row in metadata_df.iterrows():
+            main_category = row['main_category']
+            sub_category = row['sub_category']
+            print(f"\n[{idx+1}/{len(metadata_df)}] Recrawling: {main_category} - {sub_category}")
+            try:
+                counts = recrawl_subcategory(
+                    engine, main_category, sub_category, int(row['number_website']),
+                    get_stored_url(row, 'main_href'), get_stored_url(row, 'sub_href'), ttl_days
+                )
+                print(f"  Fetched {counts[0]} detail pages: {counts[1]} new companies, {counts[2]} changed")
+                totals = [total + count for total, count in zip(totals, counts)]
+            except Exception as e:
+                print(f"  Error recrawling subcategory: {e}")
+    finally:
+        engine.close()
+    print(f"\nRecrawl done: {totals[0]} detail pages fetched, {totals[1]} new companies, {totals[2]} changed")
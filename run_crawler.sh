@@ -22,6 +22,11 @@ pmset displaysleep 10
 # Cleanup function
 cleanup() {
     echo "Stopping crawler..."
+    if [ -n "$CRAWLER_PID" ]; then
+        # The crawler writes its queued results on SIGTERM before exiting
+        kill -TERM $CRAWLER_PID 2>/dev/null
+        wait $CRAWLER_PID 2>/dev/null
+    fi
     kill $CAFFEINATE_PID 2>/dev/null
     deactivate 2>/dev/null
     exit 0
@@ -36,8 +41,11 @@ while true; do
     echo "Working directory: $(pwd)"
     echo "Python version: $(python --version)"
     
-    # Run with unbuffered output
-    python -u crawl_by_metadata.py
+    # Run with unbuffered output, in the background so the trap runs while it is busy
+    python -u crawl_by_metadata.py &
+    CRAWLER_PID=$!
+    wait $CRAWLER_PID
+    CRAWLER_PID=
     
     # If script exits, wait 30 seconds and restart
     echo "Crawler stopped at $(date). Restarting in 30 seconds..."
@@ -1,22 +1,14 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import pandas as pd
-import time
+import os
 import re
-import unicodedata
-
-def setup_driver():
-    """Setup Chrome driver"""
-    chrome_options = Options()
-    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option('useAutomationExtension', False)
-    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-    
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-    return driver
+import argparse
+
+import crawl_store
+from crawl_by_metadata import ENGINE_NAMES, create_engine, load_blocklist
+from fetch_engine import BASE_URL
+
+METADATA_FILE = 'output/categories_metadata.xlsx'
+DIFF_FILE = 'output/metadata_diff.xlsx'
 
 def extract_website_count(sub_name):
     """Extract number of websites from subcategory name like 'Bếp Gas (140)'"""
@@ -25,69 +17,138 @@ def extract_website_count(sub_name):
         return int(match.group(1)), re.sub(r'\s*\(\d+\)$', '', sub_name)
     return 0, sub_name
 
-def scan_categories_metadata(driver):
-    """Scan all categories and subcategories to create metadata"""
+def scan_categories_metadata(engine):
+    """Scan all categories and subcategories into a metadata DataFrame.
+
+    Main category pages are fetched together through engine.find_links_many,
+    concurrently with the HTTP engine. Returns the DataFrame and the main
+    categories whose page failed or listed no subcategories; the DataFrame
+    is empty when the scan itself failed.
+    """
     metadata_list = []
-    
+    failed = []
+
     try:
-        driver.get("https://www.yellowpages.vn/")
-        time.sleep(5)
-        
         # Get all main categories
-        main_elements = driver.find_elements(By.CSS_SELECTOR, ".p-2.ps-1 a.text-dark")
-        main_data = [(elem.text.strip(), elem.get_attribute('href')) for elem in main_elements]
+        main_data = engine.find_links(BASE_URL, ".p-2.ps-1 a.text-dark")
         print(f"Found {len(main_data)} main categories")
-        
-        for i, (main_category, main_href) in enumerate(main_data):
-            try:
-                print(f"\n[{i+1}/{len(main_data)}] Scanning: {main_category}")
-                
-                # Navigate to main category
-                driver.get(main_href)
-                time.sleep(3)
-                
-                # Get subcategories
-                sub_elements = driver.find_elements(By.CSS_SELECTOR, ".col-sm-6.p-4.pe-3.pt-0.pb-2 a")
-                
-                for sub_element in sub_elements:
-                    try:
-                        sub_name_raw = sub_element.text.strip()
-                        website_count, sub_name_clean = extract_website_count(sub_name_raw)
-                        
-                        print(f"  - {sub_name_clean}: {website_count} websites")
-                        
-                        metadata_list.append({
-                            "main_category": main_category,
-                            "sub_category": sub_name_clean,
-                            "number_website": website_count
-                        })
-                        
-                    except Exception as e:
-                        print(f"  Error processing subcategory: {e}")
-                        continue
-                
-            except Exception as e:
-                print(f"Error scanning category {main_category}: {e}")
-                continue
-        
-        # Save metadata
-        metadata_df = pd.DataFrame(metadata_list)
-        metadata_df.to_excel('output/categories_metadata.xlsx', index=False)
-        print(f"\nSaved metadata for {len(metadata_list)} subcategories to output/categories_metadata.xlsx")
-        
+
+        sub_links = engine.find_links_many([main_href for _, main_href in main_data], ".col-sm-6.p-4.pe-3.pt-0.pb-2 a")
+
+        for i, ((main_category, main_href), sub_elements) in enumerate(zip(main_data, sub_links)):
+            print(f"\n[{i+1}/{len(main_data)}] Scanned: {main_category}")
+            if not sub_elements:
+                print(f"  No subcategories found")
+                failed.append(main_category)
+
+            for sub_name_raw, sub_href in sub_elements:
+                try:
+                    website_count, sub_name_clean = extract_website_count(sub_name_raw)
+
+                    print(f"  - {sub_name_clean}: {website_count} websites")
+
+                    metadata_list.append({
+                        "main_category": main_category,
+                        "sub_category": sub_name_clean,
+                        "number_website": website_count,
+                        "main_href": main_href,
+                        "sub_href": sub_href
+                    })
+
+                except Exception as e:
+                    print(f"  Error processing subcategory: {e}")
+                    continue
+
     except Exception as e:
+        # A partial scan would look like removed subcategories
         print(f"Error scanning categories: {e}")
+        metadata_list = []
+
+    columns = ["main_category", "sub_category", "number_website", "main_href", "sub_href"]
+    return pd.DataFrame(metadata_list, columns=columns), failed
+
+def diff_metadata(old_df, new_df):
+    """Compare two metadata scans: added, removed and count_changed subcategories"""
+    keys = ["main_category", "sub_category"]
+    merged = old_df[keys + ["number_website"]].merge(
+        new_df[keys + ["number_website"]], on=keys, how="outer", suffixes=("_old", "_new"), indicator=True
+    )
+    merged["change"] = merged["_merge"].map({"left_only": "removed", "right_only": "added", "both": "count_changed"})
+    changed = (merged["change"] != "count_changed") | (merged["number_website_old"] != merged["number_website_new"])
+    diff_df = merged[changed].rename(columns={
+        "number_website_old": "old_number_website",
+        "number_website_new": "new_number_website",
+    })
+    return diff_df[keys + ["change", "old_number_website", "new_number_website"]].reset_index(drop=True)
+
+def report_diff(diff_df, subcategories):
+    """Print the diff, save it next to the metadata and record it in the store"""
+    counts = diff_df["change"].value_counts()
+    print(f"\nChanges since the previous scan: {counts.get('added', 0)} added, "
+          f"{counts.get('removed', 0)} removed, {counts.get('count_changed', 0)} count changed")
+    for row in diff_df.itertuples(index=False):
+        print(f"  {row.change}: {row.main_category} - {row.sub_category} "
+              f"({'' if pd.isna(row.old_number_website) else int(row.old_number_website)} -> "
+              f"{'' if pd.isna(row.new_number_website) else int(row.new_number_website)})")
+
+    diff_df.to_excel(DIFF_FILE, index=False)
+    print(f"Saved {len(diff_df)} changes to {DIFF_FILE}")
+
+    changes = [
+        (row.main_category, row.sub_category, row.change,
+         None if pd.isna(row.old_number_website) else int(row.old_number_website),
+         None if pd.isna(row.new_number_website) else int(row.new_number_website))
+        for row in diff_df.itertuples(index=False)
+    ]
+    crawl_store.record_metadata_changes(changes, subcategories)
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Scan yellowpages.vn categories into categories_metadata.xlsx")
+    parser.add_argument("--engine", choices=ENGINE_NAMES, default="auto",
+                        help="Fetch engine: http, selenium, or auto (HTTP with per-page Selenium fallback)")
+    parser.add_argument("--max-per-host", type=int, default=8,
+                        help="Main category pages fetched concurrently by the HTTP engine")
+    parser.add_argument("--diff", action="store_true",
+                        help="Compare with the previous categories_metadata.xlsx and record added, removed and count-changed subcategories")
+    parser.add_argument("--lean", action="store_true",
+                        help="Headless Chrome with eager page load that blocks images, fonts, CSS and trackers")
+    parser.add_argument("--blocklist",
+                        help="File of URL patterns to block in lean mode, one per line (default: built-in list)")
+    return parser.parse_args()
 
 def main():
     """Main function"""
-    import os
+    args = parse_args()
     os.makedirs('output', exist_ok=True)
-    
-    driver = setup_driver()
+
+    engine = create_engine(
+        args.engine, max_per_host=args.max_per_host, lean=args.lean,
+        blocked_urls=load_blocklist(args.blocklist) if args.blocklist else None
+    )
     try:
-        scan_categories_metadata(driver)
+        metadata_df, failed = scan_categories_metadata(engine)
     finally:
-        driver.quit()
+        engine.close()
+
+    if metadata_df.empty:
+        print("No subcategories found, keeping the previous metadata")
+        return
+
+    old_df = pd.read_excel(METADATA_FILE) if os.path.exists(METADATA_FILE) else metadata_df.iloc[0:0]
+    if failed:
+        # Keep what the previous scan found rather than reporting those subcategories as removed
+        kept = old_df[old_df["main_category"].isin(failed)].reindex(columns=metadata_df.columns)
+        print(f"\nCould not scan {len(failed)} main categories, keeping their {len(kept)} subcategories from the previous scan: "
+              f"{', '.join(failed)}")
+        metadata_df = pd.concat([metadata_df, kept], ignore_index=True)
+
+    if args.diff:
+        report_diff(diff_metadata(old_df, metadata_df), len(metadata_df))
+
+    # Save metadata
+    metadata_df.to_excel(METADATA_FILE, index=False)
+    print(f"\nSaved metadata for {len(metadata_df)} subcategories to {METADATA_FILE}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+"""Priority scheduling of subcategories instead of spreadsheet order"""
+import time
+
+import crawl_store
+from crawl_by_metadata import get_stored_url
+
+# gap: largest remaining number_website - crawled first
+# staleness: least recently crawled first
+# backoff: skip subcategories whose last slice failed, for an exponentially growing time
+# fair: round-robin across main categories
+POLICIES = ["gap", "staleness", "backoff", "fair"]
+DEFAULT_POLICIES = ["gap", "staleness", "backoff", "fair"]
+
+BACKOFF_SECONDS = 600
+MAX_BACKOFF_SECONDS = 86400
+
+def parse_policies(text):
+    """Parse a comma-separated policy list like 'gap,fair'"""
+    policies = [policy.strip() for policy in text.split(",") if policy.strip()]
+    unknown = [policy for policy in policies if policy not in POLICIES]
+    if unknown:
+        raise ValueError(f"Unknown schedule policies: {', '.join(unknown)} (choose from {', '.join(POLICIES)})")
+    return policies
+
+def backoff_until(failures, last_failure_at):
+    """Time before which a subcategory with failures is not scheduled"""
+    if not failures or not last_failure_at:
+        return 0
+    return last_failure_at + min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (failures - 1))
+
+def build_work_items(metadata_df, state=None):
+    """Work item dicts for every incomplete subcategory in the metadata"""
+    state = crawl_store.get_schedule_state() if state is None else state
+    items = []
+    for idx, row in metadata_df.iterrows():
+        main_category = row['main_category']
+        sub_category = row['sub_category']
+        max_companies = int(row['number_website'])
+        crawled_count, updated_at, failures, last_failure_at = state.get((main_category, sub_category), (0, None, 0, None))
+        if crawled_count >= max_companies:
+            continue
+        items.append({
+            "idx": idx,
+            "main_category": main_category,
+            "sub_category": sub_category,
+            "max_companies": max_companies,
+            "crawled": crawled_count,
+            "updated_at": updated_at or 0,
+            "failures": failures or 0,
+            "retry_at": backoff_until(failures, last_failure_at),
+            "main_href": get_stored_url(row, 'main_href'),
+            "sub_href": get_stored_url(row, 'sub_href'),
+        })
+    return items
+
+def sort_key(item, policies):
+    """Sort key for the ordering policies, in the order given; metadata order breaks ties"""
+    key = []
+    for policy in policies:
+        if policy == "gap":
+            key.append(item["crawled"] - item["max_companies"])
+        elif policy == "staleness":
+            key.append(item["updated_at"])
+    key.append(item["idx"])
+    return key
+
+def order_work_items(items, policies, now=None):
+    """Order work items by the policies (no time slicing), e.g. for the worker pool"""
+    now = time.time() if now is None else now
+    if "backoff" in policies:
+        items = [item for item in items if item["retry_at"] <= now] + [item for item in items if item["retry_at"] > now]
+    ordered = sorted(items, key=lambda item: sort_key(item, policies))
+    if "fair" not in policies:
+        return ordered
+    # Round-robin across main categories, best item of each first
+    by_main = {}
+    for item in ordered:
+        by_main.setdefault(item["main_category"], []).append(item)
+    interleaved = []
+    while by_main:
+        for main_category in list(by_main):
+            interleaved.append(by_main[main_category].pop(0))
+            if not by_main[main_category]:
+                del by_main[main_category]
+    return interleaved
+
+class Scheduler:
+    """Hands out subcategories one slice at a time, re-ranking after every slice"""
+
+    def __init__(self, items, policies=DEFAULT_POLICIES):
+        self.items = list(items)
+        self.policies = policies
+        self.served = {}  # main_category -> slices handed out this run
+
+    def next(self):
+        """Best eligible work item, or None when everything left is done or backing off"""
+        now = time.time()
+        eligible = self.items
+        if "backoff" in self.policies:
+            eligible = [item for item in eligible if item["retry_at"] <= now]
+        if not eligible:
+            return None
+
+        if "fair" in self.policies:
+            # Main category served least this run, so one large category cannot starve the rest
+            least = min(self.served.get(item["main_category"], 0) for item in eligible)
+            eligible = [item for item in eligible if self.served.get(item["main_category"], 0) == least]
+
+        item = min(eligible, key=lambda item: sort_key(item, self.policies))
+        self.items.remove(item)
+        self.served[item["main_category"]] = self.served.get(item["main_category"], 0) + 1
+        return item
+
+    def report(self, item, crawled_count):
+        """Record a slice's result and put the subcategory back if it is not complete"""
+        now = time.time()
+        if crawled_count >= item["max_companies"]:
+            return
+        if crawled_count <= item["crawled"]:
+            # No progress - back off before trying this subcategory again
+            failures = crawl_store.record_schedule_failure(item["main_category"], item["sub_category"])
+            print(f"  No progress on {item['sub_category']} ({failures} failures)")
+            if "backoff" not in self.policies:
+                return  # Not again this run
+            item["failures"] = failures
+            item["retry_at"] = backoff_until(failures, now)
+        else:
+            if item["failures"]:
+                crawl_store.clear_schedule_failures(item["main_category"], item["sub_category"])
+                item["failures"] = 0
+                item["retry_at"] = 0
+            item["updated_at"] = now
+        item["crawled"] = crawled_count
+        self.items.append(item)
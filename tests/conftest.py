@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def read_page(name):
+    with open(os.path.join(PAGES_DIR, name), "rb") as f:
+        return f.read()
+
+
+class RecordedSite(ThreadingHTTPServer):
+    """Serves the recorded pages: /listing.html, any /lgs/... detail URL, 404 for /missing/..., 503 for /busy/...
+
+    delays maps a path to seconds to wait before answering; the server
+    tracks how many requests are in flight at once and when each started.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RecordedPageHandler)
+        self.delays = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+        self.started = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class RecordedPageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        site = self.server
+        with site.lock:
+            site.in_flight += 1
+            site.max_in_flight = max(site.max_in_flight, site.in_flight)
+            site.requests.append(self.path)
+            site.started.append(time.monotonic())
+        try:
+            time.sleep(site.delays.get(self.path, 0.05))
+            if self.path.startswith("/missing/"):
+                self.send_error(404)
+                return
+            if self.path.startswith("/busy/"):
+                self.send_error(503)
+                return
+            if self.path.startswith("/listing.html"):
+                # No charset anywhere: the page must still decode as UTF-8
+                body, content_type = read_page("listing.html"), "text/html"
+            elif self.path.startswith("/lgs/"):
+                body, content_type = read_page("detail.html"), "text/html; charset=utf-8"
+            else:
+                body, content_type = "<html><body><p>Trang chủ</p></body></html>".encode(), "text/html; charset=utf-8"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with site.lock:
+                site.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def recorded_site():
+    site = RecordedSite()
+    thread = threading.Thread(target=site.serve_forever, daemon=True)
+    thread.start()
+    yield site
+    site.shutdown()
+    site.server_close()
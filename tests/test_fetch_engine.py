@@ -0,0 +1,94 @@
+"""Async detail pipeline of fetch_engine against a local server serving recorded pages"""
+from fetch_engine import HttpEngine, PolitenessDelay, fetch_company_details
+
+CATEGORY = "Đồ Gia Dụng - Sản Xuất và Bán Buôn"
+
+
+def detail_cards(site, count, path="/lgs/{}/cong-ty.html"):
+    return [(f"Công ty {i}", site.url(path.format(i)), i) for i in range(1, count + 1)]
+
+
+def no_delay():
+    return PolitenessDelay(base_delay=0, factor=0)
+
+
+def test_listing_then_details(recorded_site):
+    engine = HttpEngine(pacer=no_delay())
+    try:
+        listing_url = recorded_site.url("/listing.html")
+        [cards] = engine.load_listings([listing_url])
+        assert [(name, order) for name, _, order in cards] == [
+            ("Công Ty TNHH Gia Dụng Minh Long", 1),
+            ("Công Ty Cổ Phần Nhựa Đại Đồng Tiến", 2),
+            ("Công Ty TNHH Sunhouse Việt Nam", 3),
+        ]
+        assert engine.next_page_link(listing_url) == listing_url.replace("/listing.html", "/listing.html?page=2")
+
+        results = engine.load_details(cards, CATEGORY)
+    finally:
+        engine.close()
+    assert [href for _, href, _, _ in results] == [href for _, href, _ in cards]
+    info = results[0][3]
+    assert info["Tên công ty"] == "Công Ty TNHH Gia Dụng Minh Long"
+    assert info["Điện thoại"] == "(028) 3815 6789"
+    assert info["Hotline"] == "0903 123 456"
+    assert info["Email"] == "info@minhlong.vn"
+    assert info["Ngành"] == "Đồ Gia Dụng"
+    assert info["Ngành nhỏ"] == "Sản Xuất và Bán Buôn"
+
+
+def test_results_keep_input_order(recorded_site):
+    cards = detail_cards(recorded_site, 6)
+    # Earlier cards answer last
+    for i, (_, href, _) in enumerate(cards):
+        recorded_site.delays[href[len(recorded_site.url("")):]] = 0.05 * (len(cards) - i)
+
+    results = fetch_company_details(cards, CATEGORY, max_per_host=6)
+
+    assert [(name, href, order) for name, href, order, _ in results] == cards
+    assert all(info is not None for _, _, _, info in results)
+
+
+def test_concurrency_capped_per_host(recorded_site):
+    cards = detail_cards(recorded_site, 12)
+
+    results = fetch_company_details(cards, CATEGORY, max_per_host=3)
+
+    assert len(results) == 12
+    assert recorded_site.max_in_flight == 3
+
+
+def test_failed_pages_are_none(recorded_site):
+    cards = detail_cards(recorded_site, 2) + [
+        ("Trang lỗi", recorded_site.url("/missing/1.html"), 3),
+        ("Không phải trang công ty", recorded_site.url("/trang-chu.html"), 4),
+    ]
+
+    results = fetch_company_details(cards, CATEGORY, max_per_host=4)
+
+    assert [info is None for _, _, _, info in results] == [False, False, True, True]
+
+
+def test_pacer_keeps_requests_concurrent(recorded_site):
+    pacer = PolitenessDelay(base_delay=0.2, factor=1.0)
+    cards = detail_cards(recorded_site, 8)
+    for _, href, _ in cards:
+        recorded_site.delays[href[len(recorded_site.url("")):]] = 0.3
+
+    results = fetch_company_details(cards, CATEGORY, max_per_host=4, pacer=pacer)
+
+    assert all(info is not None for _, _, _, info in results)
+    # Up to max_per_host overlap, their starts spaced by base_delay / max_per_host
+    assert 1 < recorded_site.max_in_flight <= 4
+    gaps = [later - earlier for earlier, later in zip(recorded_site.started, recorded_site.started[1:])]
+    assert min(gaps) >= 0.04
+
+
+def test_throttled_responses_back_off(recorded_site):
+    pacer = no_delay()
+    engine = HttpEngine(pacer=pacer)
+    try:
+        assert engine.fetch(recorded_site.url("/busy/1.html")) is None
+    finally:
+        engine.close()
+    assert pacer.backoff > 0
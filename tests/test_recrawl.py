@@ -0,0 +1,38 @@
+"""Listing card fingerprints of recrawl, as read by either engine"""
+from fetch_engine import parse_company_listing
+from recrawl import card_fingerprint
+
+CARD = """<html><body><div class="div_listing">
+  <div class="rounded-4 border bg-white shadow-sm mb-3 pb-4">
+    <div class="yp_sothutu"><div class="yp_sothutu_txt"><small>1</small></div></div>
+    <div class="yp_noidunglistings">
+      <h2 class="fs-5 pb-0 text-capitalize"><a href="/lgs/1188999/minh-long.html">công ty TNHH gia dụng minh long</a></h2>
+      <p>Lô 12, KCN Tân Bình,
+         Q. Tân Phú</p>
+      <p><i class="fa fa-phone"></i>Điện thoại:<b>{phone}</b></p>
+    </div>
+  </div>
+</div></body></html>"""
+
+# What Selenium's innerText returns for the same card: lines between blocks,
+# inline runs kept together, text-capitalize applied
+INNER_TEXT = "Công Ty TNHH Gia Dụng Minh Long\n\nLô 12, KCN Tân Bình, Q. Tân Phú\n\nĐiện thoại:{phone}"
+
+
+def http_card_text(phone):
+    card_texts = {}
+    [(_, href, _)] = parse_company_listing(CARD.format(phone=phone), "http://yp.test/cat", card_texts)
+    return card_texts[href]
+
+
+def test_engines_fingerprint_card_alike():
+    http_text = http_card_text("(028) 3815 6789")
+    selenium_text = INNER_TEXT.format(phone="(028) 3815 6789")
+    assert http_text != selenium_text
+
+    assert card_fingerprint(http_text) == card_fingerprint(selenium_text)
+
+
+def test_changed_card_changes_fingerprint():
+    assert card_fingerprint(http_card_text("(028) 3815 6789")) != card_fingerprint(
+        INNER_TEXT.format(phone="(028) 3815 9999"))
@@ -0,0 +1,150 @@
+"""Multi-process crawling across subcategories with a single coordinated writer"""
+import multiprocessing as mp
+import queue
+import time
+
+from background_writer import BackgroundWriter
+from crawl_by_metadata import (
+    create_engine,
+    crawl_companies_from_subcategory,
+    get_existing_companies,
+    get_stored_url,
+)
+
+class QueueSink:
+    """Forward crawl results from a worker process to the writer process"""
+
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+
+    def checkpoint(self, main_category, sub_category, companies_batch, crawled_count, position=None, completed_page=None, memberships=None):
+        self.result_queue.put((
+            "checkpoint", main_category, sub_category, list(companies_batch), crawled_count,
+            position, completed_page, list(memberships or [])
+        ))
+        return True
+
+    def sync(self, main_category, sub_category):
+        pass
+
+def crawl_worker(worker_id, task_queue, result_queue, engine_name, engine_options):
+    """Claim subcategory rows from the task queue until it is drained"""
+    engine = None
+    try:
+        engine = create_engine(engine_name, **engine_options)
+        sink = QueueSink(result_queue)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+
+            idx, total, main_category, sub_category, max_companies, crawled_count, main_href, sub_href = task
+            print(f"\n[worker {worker_id}] [{idx+1}/{total}] Processing: {main_category} - {sub_category} ({crawled_count}/{max_companies})")
+
+            existing_companies = get_existing_companies(main_category)
+            fetched = crawl_companies_from_subcategory(
+                engine, main_category, sub_category, max_companies, existing_companies, crawled_count, sink,
+                main_href, sub_href
+            )
+            print(f"[worker {worker_id}] Crawled {fetched} new companies from {sub_category}")
+    except Exception as e:
+        print(f"[worker {worker_id}] Error during crawling: {e}")
+    finally:
+        if engine is not None:
+            engine.close()
+        result_queue.put(("done", worker_id))
+
+def get_pending_tasks(metadata_df, progress):
+    """Build (idx, total, main, sub, max, crawled, main_href, sub_href) tasks for every incomplete subcategory"""
+    tasks = []
+    for idx, row in metadata_df.iterrows():
+        main_category = row['main_category']
+        sub_category = row['sub_category']
+        max_companies = int(row['number_website'])
+        crawled_count = progress.get((main_category, sub_category), 0)
+        if crawled_count < max_companies:
+            tasks.append((
+                idx, len(metadata_df), main_category, sub_category, max_companies, crawled_count,
+                get_stored_url(row, 'main_href'), get_stored_url(row, 'sub_href')
+            ))
+    return tasks
+
+def handle_result(message, sink):
+    """Hand a worker's checkpoint to the writer; True when the message says the worker finished"""
+    if message[0] == "checkpoint":
+        sink.checkpoint(*message[1:])
+        return False
+    return message[0] == "done"
+
+def drain_results(result_queue, sink, processes, timeout=30):
+    """Keep committing results until the workers exit, terminating those still running after timeout"""
+    deadline = time.monotonic() + timeout
+    try:
+        while any(process.is_alive() for process in processes) and time.monotonic() < deadline:
+            try:
+                handle_result(result_queue.get(timeout=0.5), sink)
+            except queue.Empty:
+                pass
+    finally:
+        # Even when the writer failed, never leave workers behind
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    # Whatever the workers sent before exiting is still in the pipe
+    while True:
+        try:
+            handle_result(result_queue.get(timeout=0.5), sink)
+        except queue.Empty:
+            break
+
+def crawl_with_workers(metadata_df, progress, workers, engine_name="auto", engine_options=None, policies=None):
+    """Crawl incomplete subcategories with N worker processes.
+
+    Workers claim rows from a shared queue, in scheduler order when policies
+    are given; all writes to the company store are done here, in one process,
+    by a background writer thread.
+    """
+    tasks = get_pending_tasks(metadata_df, progress)
+    if policies:
+        from scheduler import build_work_items, order_work_items
+        rank = {item["idx"]: i for i, item in enumerate(order_work_items(build_work_items(metadata_df), policies))}
+        tasks.sort(key=lambda task: rank.get(task[0], len(rank)))
+    print(f"Queued {len(tasks)} incomplete subcategories for {workers} workers")
+
+    task_queue = mp.Queue()
+    result_queue = mp.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = []
+    for worker_id in range(1, workers + 1):
+        process = mp.Process(
+            target=crawl_worker,
+            args=(worker_id, task_queue, result_queue, engine_name, engine_options or {}),
+        )
+        process.start()
+        processes.append(process)
+
+    sink = BackgroundWriter()
+    running = workers
+    try:
+        while running > 0:
+            try:
+                message = result_queue.get(timeout=5)
+            except queue.Empty:
+                # Stop waiting if every worker died without reporting back
+                if not any(process.is_alive() for process in processes):
+                    print("All workers exited unexpectedly")
+                    break
+                continue
+
+            if handle_result(message, sink):
+                running -= 1
+                print(f"Worker {message[1]} finished ({running} still running)")
+    finally:
+        # Results already queued (e.g. on SIGTERM) are committed before the workers are stopped
+        drain_results(result_queue, sink, processes)
+        sink.close()